@@ -0,0 +1,27 @@
+"""Migration
+
+Revision ID: 2c7e4f9a1b35
+Revises: 8b6d1c3f4a20
+Create Date: 2024-04-09 16:22:37.418305
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2c7e4f9a1b35"
+down_revision = "8b6d1c3f4a20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("process_request", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("acquisitions", sa.Integer(), server_default="0", nullable=False)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("process_request", schema=None) as batch_op:
+        batch_op.drop_column("acquisitions")
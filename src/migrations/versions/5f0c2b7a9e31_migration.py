@@ -0,0 +1,173 @@
+"""Migration
+
+Revision ID: 5f0c2b7a9e31
+Revises: e3b1d8f27c40
+Create Date: 2024-03-25 10:02:47.615930
+
+"""
+import os
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5f0c2b7a9e31"
+down_revision = "e3b1d8f27c40"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 32
+COPY_BATCH_SIZE = 10_000
+# Ids are handed out before their transaction commits, so rows with ids below those already copied
+# can still appear while the copy runs.  Each catch up re-copies this many ids below the copied
+# high-water mark.
+CATCH_UP_ID_OVERLAP = 1_000
+
+COLUMNS = "id, group_id, project_id, message, stacktrace_embedding, stacktrace_hash"
+
+# Only the HNSW index of the configured GROUPING_EMBEDDING_STORAGE mode exists, see e3b1d8f27c40.
+STORAGE_MODE = os.environ.get("GROUPING_EMBEDDING_STORAGE", "vector")
+EMBEDDING_INDEXES = {
+    "vector": (
+        "ix_grouping_records_stacktrace_embedding_hnsw",
+        "USING hnsw (stacktrace_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+    ),
+    "halfvec": (
+        "ix_grouping_records_stacktrace_embedding_halfvec_hnsw",
+        "USING hnsw ((stacktrace_embedding::halfvec(768)) halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)",
+    ),
+    "binary": (
+        "ix_grouping_records_stacktrace_embedding_binary_hnsw",
+        "USING hnsw ((binary_quantize(stacktrace_embedding)::bit(768)) bit_hamming_ops) "
+        "WITH (m = 16, ef_construction = 64)",
+    ),
+}
+
+INDEXES = [
+    EMBEDDING_INDEXES[STORAGE_MODE],
+    ("ix_grouping_records_project_id_stacktrace_hash", "(project_id, stacktrace_hash)"),
+]
+
+
+def copy_rows(bind, start: int, end: int):
+    """
+    Copies the rows of ids in (start, end] into the partitioned table, in batches of
+    COPY_BATCH_SIZE.
+    """
+    while start < end:
+        bind.execute(
+            sa.text(
+                f"""
+                INSERT INTO grouping_records_partitioned ({COLUMNS})
+                SELECT {COLUMNS} FROM grouping_records WHERE id > :start AND id <= :end
+                ON CONFLICT DO NOTHING
+                """
+            ),
+            {"start": start, "end": min(start + COPY_BATCH_SIZE, end)},
+        )
+        start += COPY_BATCH_SIZE
+
+
+def max_id(bind) -> int:
+    return bind.scalar(sa.text("SELECT coalesce(max(id), 0) FROM grouping_records"))
+
+
+def upgrade():
+    # Rows are copied into a new, hash partitioned table in batches while grouping keeps writing to
+    # the old one.  The tables are swapped under a write lock, which only has to copy the rows
+    # written since the last unlocked catch up.
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE TABLE grouping_records_partitioned (
+                id INTEGER NOT NULL DEFAULT nextval('grouping_records_id_seq'),
+                group_id BIGINT,
+                project_id BIGINT NOT NULL,
+                message VARCHAR NOT NULL,
+                stacktrace_embedding VECTOR(768) NOT NULL,
+                stacktrace_hash VARCHAR(32),
+                CONSTRAINT grouping_records_partitioned_pkey PRIMARY KEY (id, project_id)
+            ) PARTITION BY HASH (project_id)
+            """
+        )
+        for remainder in range(PARTITIONS):
+            op.execute(
+                f"CREATE TABLE grouping_records_partitioned_p{remainder} "
+                "PARTITION OF grouping_records_partitioned "
+                f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+            )
+        op.execute(
+            "CREATE UNIQUE INDEX ix_grouping_records_project_id_group_id_new "
+            "ON grouping_records_partitioned (project_id, group_id)"
+        )
+
+        copied = max_id(bind)
+        copy_rows(bind, 0, copied)
+
+        # Built once the bulk of the rows are in, which is much faster than maintaining them during
+        # the copy.
+        for name, definition in INDEXES:
+            op.execute(f"CREATE INDEX {name}_new ON grouping_records_partitioned {definition}")
+
+        # Catches up with the rows written while the indexes were built, without blocking writes, so
+        # that only those written since are left for the locked pass.
+        caught_up = max_id(bind)
+        copy_rows(bind, copied - CATCH_UP_ID_OVERLAP, caught_up)
+        copied = caught_up
+
+    # Reads continue during the swap, writes wait for it.
+    op.execute("LOCK TABLE grouping_records IN EXCLUSIVE MODE")
+    copy_rows(bind, copied - CATCH_UP_ID_OVERLAP, max_id(bind))
+    op.execute("ALTER SEQUENCE grouping_records_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE grouping_records")
+    op.execute("ALTER TABLE grouping_records_partitioned RENAME TO grouping_records")
+    op.execute("ALTER SEQUENCE grouping_records_id_seq OWNED BY grouping_records.id")
+    op.execute(
+        "ALTER TABLE grouping_records "
+        "RENAME CONSTRAINT grouping_records_partitioned_pkey TO grouping_records_pkey"
+    )
+    for name, _ in INDEXES + [("ix_grouping_records_project_id_group_id", "")]:
+        op.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f"ALTER TABLE grouping_records_partitioned_p{remainder} "
+            f"RENAME TO grouping_records_p{remainder}"
+        )
+
+
+def downgrade():
+    op.execute(
+        """
+        CREATE TABLE grouping_records_unpartitioned (
+            id SERIAL NOT NULL PRIMARY KEY,
+            group_id BIGINT,
+            project_id BIGINT NOT NULL,
+            message VARCHAR NOT NULL,
+            stacktrace_embedding VECTOR(768) NOT NULL,
+            stacktrace_hash VARCHAR(32)
+        )
+        """
+    )
+    op.execute(
+        f"INSERT INTO grouping_records_unpartitioned ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM grouping_records"
+    )
+    op.execute(
+        "SELECT setval('grouping_records_unpartitioned_id_seq', "
+        "(SELECT coalesce(max(id), 0) + 1 FROM grouping_records_unpartitioned), false)"
+    )
+    op.execute("DROP TABLE grouping_records")
+    op.execute("ALTER TABLE grouping_records_unpartitioned RENAME TO grouping_records")
+    op.execute(
+        "ALTER SEQUENCE grouping_records_unpartitioned_id_seq RENAME TO grouping_records_id_seq"
+    )
+    op.execute(
+        "ALTER TABLE grouping_records "
+        "RENAME CONSTRAINT grouping_records_unpartitioned_pkey TO grouping_records_pkey"
+    )
+    for name, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON grouping_records {definition}")
+    op.execute("CREATE INDEX ix_grouping_records_project_id ON grouping_records (project_id)")
+    op.execute("CREATE UNIQUE INDEX ix_grouping_records_group_id ON grouping_records (group_id)")
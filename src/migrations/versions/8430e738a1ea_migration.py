@@ -0,0 +1,35 @@
+"""Migration
+
+Revision ID: 8430e738a1ea
+Revises: 913d11ce1bea
+Create Date: 2024-03-20 16:12:41.118203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8430e738a1ea"
+down_revision = "913d11ce1bea"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest record of any group that was inserted more than once before group_id became
+    # unique.
+    op.execute(
+        """
+        DELETE FROM grouping_records
+        USING grouping_records AS older
+        WHERE grouping_records.group_id = older.group_id
+          AND grouping_records.id > older.id
+        """
+    )
+    with op.batch_alter_table("grouping_records", schema=None) as batch_op:
+        batch_op.create_index("ix_grouping_records_group_id", ["group_id"], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table("grouping_records", schema=None) as batch_op:
+        batch_op.drop_index("ix_grouping_records_group_id")
@@ -0,0 +1,31 @@
+"""Migration
+
+Revision ID: 8b6d1c3f4a20
+Revises: 5f0c2b7a9e31
+Create Date: 2024-04-02 10:14:51.602114
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b6d1c3f4a20"
+down_revision = "5f0c2b7a9e31"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("process_request", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("lane", sa.String(length=32), server_default="default", nullable=False)
+        )
+        batch_op.create_index(
+            "ix_process_request_lane_scheduled_for", ["lane", "scheduled_for"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("process_request", schema=None) as batch_op:
+        batch_op.drop_index("ix_process_request_lane_scheduled_for")
+        batch_op.drop_column("lane")
@@ -0,0 +1,64 @@
+"""Migration
+
+Revision ID: e3b1d8f27c40
+Revises: c52f4a0e9d17
+Create Date: 2024-03-22 11:37:05.284513
+
+"""
+import os
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e3b1d8f27c40"
+down_revision = "c52f4a0e9d17"
+branch_labels = None
+depends_on = None
+
+
+# The HNSW index of each GROUPING_EMBEDDING_STORAGE mode, see DbGroupingRecord.
+STORAGE_MODE = os.environ.get("GROUPING_EMBEDDING_STORAGE", "vector")
+FULL_PRECISION_INDEX = (
+    "ix_grouping_records_stacktrace_embedding_hnsw",
+    "USING hnsw (stacktrace_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+)
+QUANTIZED_INDEXES = {
+    "halfvec": (
+        "ix_grouping_records_stacktrace_embedding_halfvec_hnsw",
+        "USING hnsw ((stacktrace_embedding::halfvec(768)) halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)",
+    ),
+    "binary": (
+        "ix_grouping_records_stacktrace_embedding_binary_hnsw",
+        "USING hnsw ((binary_quantize(stacktrace_embedding)::bit(768)) bit_hamming_ops) "
+        "WITH (m = 16, ef_construction = 64)",
+    ),
+}
+
+
+def upgrade():
+    # Replaces the full precision HNSW index with the quantized one of the configured storage mode,
+    # if any.  Requires pgvector >= 0.7.  Built concurrently so grouping stays writable while it
+    # builds, and the full precision index is only dropped once its replacement is ready.
+    if STORAGE_MODE not in QUANTIZED_INDEXES:
+        return
+
+    name, definition = QUANTIZED_INDEXES[STORAGE_MODE]
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON grouping_records {definition}"
+        )
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {FULL_PRECISION_INDEX[0]}")
+
+
+def downgrade():
+    if STORAGE_MODE not in QUANTIZED_INDEXES:
+        return
+
+    name, definition = FULL_PRECISION_INDEX
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON grouping_records {definition}"
+        )
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {QUANTIZED_INDEXES[STORAGE_MODE][0]}")
@@ -10,6 +10,11 @@ from seer.automation.autofix.models import AutofixEndpointResponse, AutofixReque
 from seer.automation.autofix.tasks import run_autofix
 from seer.bootup import bootup
 from seer.db import ProcessRequest, Session
+from seer.grouping.backfill import (
+    GroupingBackfillRequest,
+    GroupingBackfillResponse,
+    schedule_backfill,
+)
 from seer.grouping.grouping import GroupingRequest, SimilarityResponse
 from seer.inference_models import embeddings_model, grouping_lookup
 from seer.json_api import json_api, register_json_api_views
@@ -20,11 +25,12 @@ app = bootup(
     __name__,
     [FlaskIntegration()],
     init_migrations=True,
+    with_async=True,
     eager_load_inference_models=os.environ.get("LAZY_INFERENCE_MODELS") != "1",
 )
 
 
-@json_api("/v0/issues/severity-score")
+@json_api("/v0/issues/severity-score", max_concurrency=16, queue_timeout=0.5)
 def severity_endpoint(data: SeverityRequest) -> SeverityResponse:
     if data.trigger_error:
         raise Exception("oh no")
@@ -40,7 +46,7 @@ def severity_endpoint(data: SeverityRequest) -> SeverityResponse:
     return response
 
 
-@json_api("/trends/breakpoint-detector")
+@json_api("/trends/breakpoint-detector", max_concurrency=4, queue_timeout=2.0)
 def breakpoint_trends_endpoint(data: BreakpointRequest) -> BreakpointResponse:
     txns_data = data.data
 
@@ -71,12 +77,20 @@ def breakpoint_trends_endpoint(data: BreakpointRequest) -> BreakpointResponse:
 
 
 @json_api("/v0/issues/similar-issues")
-def similarity_endpoint(data: GroupingRequest) -> SimilarityResponse:
+async def similarity_endpoint(data: GroupingRequest) -> SimilarityResponse:
     with sentry_sdk.start_span(op="seer.grouping", description="grouping lookup") as span:
-        similar_issues = grouping_lookup().get_nearest_neighbors(data)
+        similar_issues = await grouping_lookup().get_nearest_neighbors_async(data)
     return similar_issues
 
 
+@json_api("/v0/issues/similar-issues/backfill")
+def similarity_backfill_endpoint(data: GroupingBackfillRequest) -> GroupingBackfillResponse:
+    with Session() as session:
+        schedule_backfill(session, data)
+        session.commit()
+    return GroupingBackfillResponse(scheduled=True)
+
+
 @json_api("/v0/automation/autofix")
 def autofix_endpoint(data: AutofixRequest) -> AutofixEndpointResponse:
     run_autofix.delay(data.model_dump(mode="json"))
@@ -0,0 +1,40 @@
+"""
+Serves the json_api endpoints of seer.app from an aiohttp server instead of Flask, so that one
+process can multiplex many requests that are waiting on I/O.  Enabled with ASYNC_SERVER_ENABLE=true,
+see webserver.sh.
+
+    gunicorn --worker-class aiohttp.GunicornWebWorker src.seer.async_app:create_app
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from seer.compression import MAX_BODY_SIZE
+from seer.json_api import ASYNC_HANDLER_ARGS, register_async_json_api_views
+
+
+async def health_check(request: web.Request) -> web.Response:
+    return web.Response()
+
+
+async def create_app() -> web.Application:
+    # Boots up and registers the json_api views
+    import seer.app  # noqa
+
+    # Synchronous endpoints run on the default executor; model encodes are further serialized by the
+    # inference executor, so these threads mostly wait on Postgres.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=int(os.environ.get("ASYNC_SERVER_THREADS", 8)),
+            thread_name_prefix="json-api",
+        )
+    )
+
+    # Bounds the body as sent, read_body bounds it once decompressed.
+    app = web.Application(client_max_size=MAX_BODY_SIZE, handler_args=ASYNC_HANDLER_ARGS)
+    app.router.add_get("/health/live", health_check)
+    app.router.add_get("/health/ready", health_check)
+    register_async_json_api_views(app)
+    return app
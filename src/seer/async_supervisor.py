@@ -0,0 +1,154 @@
+"""
+Runs several AsyncApp worker processes on one node, so that CPU bound work in the invocations of one
+process does not hold up the consumers of the others.  Enabled with ASYNC_WORKER_PROCESSES > 1, see
+tasks.py.
+"""
+import asyncio
+import dataclasses
+import logging
+import multiprocessing
+import multiprocessing.synchronize
+import signal
+import time
+from multiprocessing.context import SpawnProcess
+from multiprocessing.sharedctypes import SynchronizedBase
+from typing import Callable
+
+logger = logging.getLogger("asyncrunner")
+
+WorkerTarget = Callable[[multiprocessing.synchronize.Event, SynchronizedBase], None]
+
+
+def run_worker(kill_event: multiprocessing.synchronize.Event, heartbeat: SynchronizedBase):
+    """
+    Entry point of a worker process: runs an AsyncApp until the kill event is set, beating the
+    heartbeat every second while its event loop is responsive.
+    """
+    # Shutdown is driven by the supervisor through the kill event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker_main(kill_event, heartbeat))
+
+
+async def worker_main(kill_event: multiprocessing.synchronize.Event, heartbeat: SynchronizedBase):
+    from seer.tasks import async_main
+
+    async def beat():
+        while True:
+            heartbeat.get_obj().value = time.time()
+            await asyncio.sleep(1)
+
+    beat_task = asyncio.create_task(beat())
+    try:
+        await async_main(kill_event)
+    finally:
+        beat_task.cancel()
+
+
+@dataclasses.dataclass
+class Worker:
+    process: SpawnProcess
+    heartbeat: SynchronizedBase
+    started_at: float
+
+    def is_healthy(self, now: float, health_timeout: float) -> bool:
+        return now - max(self.heartbeat.get_obj().value, self.started_at) < health_timeout
+
+
+@dataclasses.dataclass
+class WorkerSupervisor:
+    """
+    Keeps `num_processes` worker processes running.  Workers that exit are restarted, as are workers
+    whose event loop has not beaten their heartbeat for `health_timeout` seconds.  A worker that
+    keeps failing is restarted after a delay doubling from `restart_delay` up to `max_restart_delay`
+    seconds, as each start reloads the models.  Once the kill event is set, workers finish the work
+    they are on, as AsyncApp does on its end event, and any still running after `shutdown_timeout`
+    seconds are terminated.
+    """
+
+    num_processes: int
+    health_timeout: float = 300
+    shutdown_timeout: float = 30
+    target: WorkerTarget = run_worker
+    context: multiprocessing.context.SpawnContext = dataclasses.field(
+        default_factory=lambda: multiprocessing.get_context("spawn")
+    )
+    kill_event: multiprocessing.synchronize.Event = dataclasses.field(init=False)
+    workers: list[Worker | None] = dataclasses.field(init=False)
+    restarts: int = 0
+    restart_delay: float = 1
+    max_restart_delay: float = 60
+    # Per worker, how many times in a row it failed, and when it is next started
+    failures: list[int] = dataclasses.field(init=False)
+    start_at: list[float] = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        self.kill_event = self.context.Event()
+        self.workers = [None] * self.num_processes
+        self.failures = [0] * self.num_processes
+        self.start_at = [0.0] * self.num_processes
+
+    def backoff(self, failures: int) -> float:
+        return min(self.restart_delay * 2 ** (failures - 1), self.max_restart_delay)
+
+    def start_worker(self, index: int) -> Worker:
+        heartbeat = self.context.Value("d", 0.0)
+        process = self.context.Process(
+            target=self.target,
+            args=(self.kill_event, heartbeat),
+            name=f"async-worker-{index}",
+            daemon=False,
+        )
+        process.start()
+        logger.info(f"Started async worker {index} as pid {process.pid}")
+        return Worker(process=process, heartbeat=heartbeat, started_at=time.time())
+
+    def check_workers(self):
+        now = time.time()
+        for index, worker in enumerate(self.workers):
+            if worker is not None:
+                if not worker.process.is_alive():
+                    logger.warning(
+                        f"Async worker {index} exited with {worker.process.exitcode}, restarting..."
+                    )
+                elif not worker.is_healthy(now, self.health_timeout):
+                    logger.warning(f"Async worker {index} is unresponsive, restarting...")
+                    worker.process.kill()
+                    worker.process.join()
+                else:
+                    continue
+                self.restarts += 1
+                # A worker that ran for a while before failing starts over from the shortest delay
+                if now - worker.started_at >= self.max_restart_delay:
+                    self.failures[index] = 0
+                self.failures[index] += 1
+                self.start_at[index] = now + self.backoff(self.failures[index])
+                self.workers[index] = None
+            if now >= self.start_at[index]:
+                self.workers[index] = self.start_worker(index)
+
+    def run(self):
+        while not self.kill_event.is_set():
+            self.check_workers()
+            self.kill_event.wait(1)
+
+        logger.info("Shutting down async workers")
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self.workers:
+            if worker is not None:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+        for worker in self.workers:
+            if worker is not None and worker.process.is_alive():
+                logger.warning(f"Terminating async worker {worker.process.name}")
+                worker.process.terminate()
+                worker.process.join()
+
+    def stop(self, *args):
+        self.kill_event.set()
+
+
+def supervise(num_processes: int, health_timeout: float):
+    supervisor = WorkerSupervisor(num_processes=num_processes, health_timeout=health_timeout)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
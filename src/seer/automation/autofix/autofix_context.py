@@ -14,7 +14,7 @@ from seer.automation.codebase.models import StoredDocumentChunk, StoredDocumentC
 from seer.automation.pipeline import PipelineContext
 from seer.automation.state import State
 from seer.automation.utils import get_embedding_model
-from seer.db import DbDocumentChunk, Session
+from seer.db import DbDocumentChunk, Session, replica_router
 
 
 class AutofixContext(PipelineContext):
@@ -93,7 +93,9 @@ class AutofixContext(PipelineContext):
 
         embedding = self.embedding_model.encode(query)
 
-        with Session() as session:
+        # Also searches the chunks this run stored temporarily, so it has to see this process' own
+        # writes.
+        with replica_router.session(consistent_with_writes=True) or Session() as session:
             db_chunks = (
                 session.query(DbDocumentChunk)
                 .filter(
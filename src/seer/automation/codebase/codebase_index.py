@@ -38,7 +38,7 @@ from seer.automation.codebase.utils import (
     read_specific_files,
 )
 from seer.automation.models import FileChange, FilePatch, Hunk, Line
-from seer.db import DbDocumentChunk, DbDocumentTombstone, DbRepositoryInfo, Session
+from seer.db import DbDocumentChunk, DbDocumentTombstone, DbRepositoryInfo, Session, replica_router
 from seer.utils import batch_save_to_db, class_method_lru_cache
 
 logger = logging.getLogger("autofix")
@@ -380,7 +380,9 @@ class CodebaseIndex:
 
         embedding = self.embedding_model.encode(query, show_progress_bar=False)
 
-        with Session() as session:
+        # Also searches the chunks this run stored temporarily, so it has to see this process' own
+        # writes.
+        with replica_router.session(consistent_with_writes=True) or Session() as session:
             db_chunks = (
                 session.query(DbDocumentChunk)
                 .filter(
@@ -7,9 +7,10 @@ from celery import Celery
 from flask import Flask
 from psycopg import Connection
 from sentry_sdk.integrations import Integration
+from sqlalchemy import create_engine
 from sqlalchemy.ext.asyncio import create_async_engine
 
-from seer.db import AsyncSession, Session, db, migrate
+from seer.db import AsyncSession, Session, db, migrate, pool_options, replica_router
 
 logger = logging.getLogger(__name__)
 
@@ -45,12 +46,16 @@ def bootup(
         traces_sampler=traces_sampler,
         profiles_sample_rate=1.0,
         enable_tracing=True,
+        _experiments={"enable_metrics": True},
     )
     app = Flask(name)
 
     uri = os.environ["DATABASE_URL"]
     app.config["SQLALCHEMY_DATABASE_URI"] = uri
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"prepare_threshold": None}}
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "connect_args": {"prepare_threshold": None},
+        **pool_options("primary"),
+    }
 
     from seer.inference_models import cached
 
@@ -63,10 +68,23 @@ def bootup(
             if with_async:
                 AsyncSession.configure(
                     bind=create_async_engine(
-                        db.engine.url, connect_args={"prepare_threshold": None}
+                        db.engine.url,
+                        connect_args={"prepare_threshold": None},
+                        **pool_options("async", async_=True),
                     )
                 )
 
+        replica_uri = os.environ.get("DATABASE_REPLICA_URL")
+        if replica_uri:
+            replica_router.configure(
+                create_engine(
+                    replica_uri,
+                    connect_args={"prepare_threshold": None},
+                    **pool_options("replica"),
+                ),
+                max_lag=float(os.environ.get("DATABASE_REPLICA_MAX_LAG", 1.0)),
+            )
+
     if eager_load_inference_models:
         for item in cached:
             # Preload model
@@ -0,0 +1,117 @@
+import gzip
+import os
+import zlib
+from typing import IO, Optional, Protocol
+
+import zstandard
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.http import parse_accept_header
+
+# Upper bound on a decompressed request body.  Decompression stops as soon as it is crossed, so a
+# small, highly compressed body cannot be expanded past it.
+MAX_BODY_SIZE = int(os.environ.get("JSON_API_MAX_BODY_SIZE", 64 * 1024 * 1024))
+
+# Responses smaller than this are sent as is, they would gain less from compression than it costs.
+MIN_COMPRESSED_SIZE = 1024
+
+# In order of preference, when the client accepts both with the same quality.
+RESPONSE_ENCODINGS = ["zstd", "gzip"]
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class Readable(Protocol):
+    def read(self, size: int = -1, /) -> bytes:
+        ...
+
+
+class DeflateReader:
+    """
+    Decompresses a deflate stream as it is read.  Like aiohttp, accepts both the zlib format the
+    encoding is specified as and the raw deflate data some clients send instead.
+    """
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+        self.decompressor: Optional["zlib._Decompress"] = None
+
+    def read(self, size: int = -1, /) -> bytes:
+        while True:
+            if self.decompressor is not None and self.decompressor.unconsumed_tail:
+                data = self.decompressor.unconsumed_tail
+            else:
+                data = self.stream.read(READ_CHUNK_SIZE)
+                if not data:
+                    if self.decompressor is not None and not self.decompressor.eof:
+                        raise zlib.error("Incomplete deflate stream")
+                    return b""
+
+            if self.decompressor is None:
+                # The low bits of a zlib header's first byte are its compression method, 8 for
+                # deflate.
+                raw = data[0] & 0x0F != 8
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+            if self.decompressor.eof:
+                return b""
+
+            chunk = self.decompressor.decompress(data, max(size, 0))
+            if chunk:
+                return chunk
+
+
+def decompressing_reader(stream: IO[bytes], content_encoding: str) -> Readable:
+    encoding = content_encoding.strip().lower()
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if encoding == "deflate":
+        return DeflateReader(stream)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedMediaType(f"Unsupported Content-Encoding {content_encoding!r}")
+
+
+def read_body(
+    stream: IO[bytes], content_encoding: Optional[str], max_size: int = MAX_BODY_SIZE
+) -> bytes:
+    """
+    Reads the body from the stream, decompressing it as it is read when it has a gzip, deflate or
+    zstd Content-Encoding.  Raises RequestEntityTooLarge once more than `max_size` bytes have been
+    produced, without reading further.
+    """
+    reader: Readable = stream
+    if content_encoding and content_encoding.strip().lower() != "identity":
+        reader = decompressing_reader(stream, content_encoding)
+
+    chunks = []
+    size = 0
+    try:
+        while chunk := reader.read(min(READ_CHUNK_SIZE, max_size + 1 - size)):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_size:
+                raise RequestEntityTooLarge(f"Request body is larger than {max_size} bytes")
+    except (OSError, EOFError, zlib.error, zstandard.ZstdError) as e:
+        raise BadRequest(f"Could not decompress request body: {e}")
+
+    return b"".join(chunks)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    return parse_accept_header(accept_encoding).best_match(RESPONSE_ENCODINGS)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=5)
+
+
+def encode_response(body: bytes, accept_encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+    """
+    Compresses the response body with the encoding preferred by the client, if any and if the body
+    is large enough to be worth it.  Returns the body to send along with its Content-Encoding.
+    """
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= MIN_COMPRESSED_SIZE else None
+    if encoding is None:
+        return body, None
+    return compress(body, encoding), encoding
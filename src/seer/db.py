@@ -1,28 +1,47 @@
 import contextlib
 import datetime
 import json
-from typing import Optional
-
+import logging
+import math
+import os
+import threading
+import time
+from typing import Collection, Optional
+
+import sentry_sdk
+import sentry_sdk.metrics
 import sqlalchemy
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from pgvector.sqlalchemy import Vector  # type: ignore
 from pydantic import BaseModel
 from sqlalchemy import (
+    DDL,
     JSON,
     BigInteger,
     DateTime,
     ForeignKey,
     Index,
     Integer,
+    Interval,
     String,
     delete,
+    event,
     func,
+    literal,
+    literal_column,
     select,
+    text,
+    update,
 )
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.types import UserDefinedType
 
 
 class Base(DeclarativeBase):
@@ -34,6 +53,161 @@ db: SQLAlchemy = SQLAlchemy(model_class=Base)
 migrate = Migrate(directory="src/migrations")
 Session = sessionmaker(autoflush=False, expire_on_commit=False)
 AsyncSession = async_sessionmaker(expire_on_commit=False)
+# Bound to DATABASE_REPLICA_URL, if set.  Use replica_router.session() rather than this directly.
+ReplicaSession = sessionmaker(autoflush=False, expire_on_commit=False)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetricsMixin:
+    """
+    Reports how long each checkout waited for a connection, and how many connections are checked out
+    after it, tagged with the pool's logging name.  Sustained waits mean the pool, or the database
+    behind it, is too small for the concurrency of the process.
+    """
+
+    def _do_get(self):
+        start = time.monotonic()
+        connection = super()._do_get()  # type: ignore[misc]
+        tags = {"pool": getattr(self, "logging_name", None) or "default"}
+        sentry_sdk.metrics.distribution(
+            "seer.db.pool.wait", time.monotonic() - start, unit="second", tags=tags
+        )
+        checked_out = self.checkedout()  # type: ignore[attr-defined]
+        sentry_sdk.metrics.gauge("seer.db.pool.checked_out", checked_out, tags=tags)
+        return connection
+
+
+class InstrumentedQueuePool(PoolMetricsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(logging_name: str, async_: bool = False) -> dict:
+    """
+    Engine keyword arguments for a connection pool sized from the environment.
+    """
+    return dict(
+        poolclass=InstrumentedAsyncAdaptedQueuePool if async_ else InstrumentedQueuePool,
+        pool_logging_name=logging_name,
+        pool_size=int(os.environ.get("DATABASE_POOL_SIZE", 10)),
+        max_overflow=int(os.environ.get("DATABASE_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DATABASE_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DATABASE_POOL_RECYCLE", 1800)),
+        pool_pre_ping=True,
+    )
+
+
+# How far behind the primary a replica is, in seconds.  0 when it has replayed everything it
+# received, or when the database is not a replica at all.
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+# Set in Session.info once the session's transaction has written, so only commits that wrote are
+# recorded.
+SESSION_WROTE = "replica_router_wrote"
+
+
+def statement_writes(statement) -> bool:
+    """
+    Whether executing the statement may write, including through a data modifying CTE.  Textual
+    statements are assumed to write unless they are a SELECT or SHOW.
+    """
+    if isinstance(statement, TextClause):
+        return not statement.text.lstrip().upper().startswith(("SELECT", "SHOW"))
+    return any(isinstance(element, UpdateBase) for element in visitors.iterate(statement))
+
+
+class ReplicaRouter:
+    """
+    Sends read only queries that tolerate slightly stale data, such as vector searches, to a read
+    replica, so that they do not compete with writes and the ProcessRequest queue on the primary.
+
+    The replica's lag is measured at most every `check_interval` seconds.  While it is over
+    `max_lag`, or the replica cannot be reached, session() returns None and callers stay on the
+    primary.  Callers that must see this process' own recent writes pass consistent_with_writes, and
+    stay on the primary for `max_lag` seconds after any commit that wrote.
+    """
+
+    def __init__(self, max_lag: float = 1.0, check_interval: float = 5.0):
+        self.enabled = False
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.last_write = -math.inf
+        self._lag = math.inf
+        self._lag_checked_at = -math.inf
+        self._lock = threading.Lock()
+
+    def configure(self, bind: sqlalchemy.Engine, max_lag: float):
+        ReplicaSession.configure(bind=bind)
+        self.max_lag = max_lag
+        self.enabled = True
+
+    def session(self, consistent_with_writes: bool = False) -> Optional[sqlalchemy.orm.Session]:
+        if not self.enabled or self.lag() > self.max_lag:
+            return None
+        if consistent_with_writes and time.monotonic() - self.last_write <= self.max_lag:
+            return None
+        return ReplicaSession()
+
+    def lag(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._lag_checked_at < self.check_interval:
+                return self._lag
+            self._lag_checked_at = now
+
+        try:
+            with ReplicaSession() as session:
+                lag = session.scalar(REPLICA_LAG_QUERY)
+        except Exception:
+            logger.exception("Failed to measure the lag of the read replica")
+            lag = None
+
+        self._lag = math.inf if lag is None else float(lag)
+        return self._lag
+
+    def record_flush(self, session: sqlalchemy.orm.Session, flush_context):
+        session.info[SESSION_WROTE] = True
+
+    def record_execute(self, orm_execute_state: sqlalchemy.orm.ORMExecuteState):
+        if statement_writes(orm_execute_state.statement):
+            orm_execute_state.session.info[SESSION_WROTE] = True
+
+    def record_write(self, session: sqlalchemy.orm.Session):
+        if session.info.pop(SESSION_WROTE, False):
+            self.last_write = time.monotonic()
+
+    def discard_writes(self, session: sqlalchemy.orm.Session):
+        session.info.pop(SESSION_WROTE, None)
+
+
+replica_router = ReplicaRouter()
+event.listen(Session, "after_flush", replica_router.record_flush)
+event.listen(Session, "do_orm_execute", replica_router.record_execute)
+event.listen(Session, "after_commit", replica_router.record_write)
+event.listen(Session, "after_rollback", replica_router.discard_writes)
+
+
+# Notified with the name of each ProcessRequest as it is scheduled.
+PROCESS_REQUEST_CHANNEL = "process_request"
+
+# Lanes partition ProcessRequest work so that AsyncApp can cap how much of each kind runs at once.
+# Bulk work, such as backfills, goes in BULK_LANE so that a flood of it cannot occupy every
+# consumer.
+DEFAULT_LANE = "default"
+BULK_LANE = "bulk"
 
 
 class ProcessRequest(Base):
@@ -67,6 +241,15 @@ class ProcessRequest(Base):
         DateTime, default=datetime.datetime.utcnow, nullable=False
     )
     payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    lane: Mapped[str] = mapped_column(
+        String(32), default=DEFAULT_LANE, server_default=DEFAULT_LANE, nullable=False
+    )
+    # How many times the work was acquired since it was last scheduled
+    acquisitions: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+
+    __table_args__ = (Index("ix_process_request_lane_scheduled_for", "lane", "scheduled_for"),)
 
     @property
     def is_terminated(self) -> bool:
@@ -78,6 +261,23 @@ class ProcessRequest(Base):
     def next_schedule(self, now: datetime.datetime) -> datetime.datetime:
         return now + min((self.last_delay() * 2), datetime.timedelta(hours=1))
 
+    def retries(self) -> int:
+        """
+        How many times work that was just acquired was acquired before, since it was last scheduled.
+        """
+        return max(0, self.acquisitions - 1)
+
+    @classmethod
+    def ready_by_prefix_stmt(cls, now: datetime.datetime) -> sqlalchemy.Select:
+        """
+        Counts the work due before `now` by the prefix of its name, up to the first ':'.  Scans only
+        the due range of the scheduled_for index.
+        """
+        # Literals rather than parameters, so that the grouped and selected expressions are the same
+        # to the planner
+        prefix = func.split_part(cls.name, literal_column("':'"), literal_column("1"))
+        return select(prefix, func.count()).where(cls.scheduled_for < now).group_by(prefix)
+
     @classmethod
     def schedule_stmt(
         cls,
@@ -85,7 +285,25 @@ class ProcessRequest(Base):
         payload: dict | str | bytes | BaseModel,
         when: datetime.datetime,
         expected_duration: datetime.timedelta = datetime.timedelta(seconds=0),
-    ) -> sqlalchemy.UpdateBase:
+        lane: str = DEFAULT_LANE,
+    ) -> sqlalchemy.Select:
+        """
+        Upserts the work, and notifies PROCESS_REQUEST_CHANNEL with its name once the transaction
+        commits, so that idle AsyncApp producers pick it up without waiting for their next poll.
+        """
+        return cls.schedule_many_stmt(
+            [cls.schedule_values(name, payload, when, expected_duration, lane)]
+        )
+
+    @classmethod
+    def schedule_values(
+        cls,
+        name: str,
+        payload: dict | str | bytes | BaseModel,
+        when: datetime.datetime,
+        expected_duration: datetime.timedelta = datetime.timedelta(seconds=0),
+        lane: str = DEFAULT_LANE,
+    ) -> dict:
         scheduled_from = scheduled_for = when
         # This increases last_delay.  When the item is scheduled, the 'next' schedule will be double this.
         scheduled_from -= expected_duration
@@ -96,24 +314,44 @@ class ProcessRequest(Base):
         if isinstance(payload, (str, bytes)):
             payload = json.loads(payload)
 
-        insert_stmt = insert(cls).values(
+        return dict(
             name=name,
             payload=payload,
             scheduled_for=scheduled_for,
             scheduled_from=scheduled_from,
             created_at=when,
+            lane=lane,
         )
 
-        scheduled_for_update = func.least(insert_stmt.excluded.scheduled_for, cls.scheduled_for)
+    @classmethod
+    def schedule_many_stmt(cls, rows: list[dict]) -> sqlalchemy.Select:
+        """
+        schedule_stmt for many rows of schedule_values, with distinct names, in one statement.
+        """
+        insert_stmt = insert(cls).values(rows)
+        excluded = insert_stmt.excluded
+
+        scheduled_for_update = func.least(excluded.scheduled_for, cls.scheduled_for)
+        expected_duration = excluded.scheduled_for - excluded.scheduled_from
+
+        scheduled = (
+            insert_stmt.on_conflict_do_update(
+                index_elements=[cls.name],
+                set_={
+                    cls.payload: excluded.payload,
+                    cls.scheduled_from: scheduled_for_update - expected_duration,
+                    cls.scheduled_for: scheduled_for_update,
+                    cls.created_at: excluded.created_at,
+                    cls.lane: excluded.lane,
+                    cls.acquisitions: 0,
+                },
+            )
+            .returning(cls.name)
+            .cte("scheduled")
+        )
 
-        return insert_stmt.on_conflict_do_update(
-            index_elements=[cls.name],
-            set_={
-                cls.payload: payload,
-                cls.scheduled_from: scheduled_for_update - expected_duration,
-                cls.scheduled_for: scheduled_for_update,
-                cls.created_at: when,
-            },
+        return select(func.pg_notify(PROCESS_REQUEST_CHANNEL, scheduled.c.name)).select_from(
+            scheduled
         )
 
     @classmethod
@@ -127,36 +365,190 @@ class ProcessRequest(Base):
         return result
 
     @classmethod
-    def acquire_work(
-        cls, batch_size: int, now: datetime.datetime, session: sqlalchemy.orm.Session | None = None
+    def acquire_work_stmt(
+        cls,
+        batch_size: int,
+        now: datetime.datetime,
+        lanes: Collection[str] | None = None,
+        exclude_lanes: Collection[str] = (),
     ):
+        """
+        Reschedules up to `batch_size` items due before `now` as next_schedule would, and returns
+        them, in a single round trip.  Rows locked by a concurrent acquisition are skipped rather
+        than waited on, so concurrent workers take disjoint batches instead of queueing behind each
+        other.
+
+        Only items of the given `lanes`, if any, and not of `exclude_lanes`, are acquired.
+        """
+        due = select(cls.id).where(cls.scheduled_for < now)
+        if lanes is not None:
+            due = due.where(cls.lane.in_(lanes))
+        if exclude_lanes:
+            due = due.where(cls.lane.not_in(exclude_lanes))
+        due = due.order_by(cls.scheduled_for).limit(batch_size).with_for_update(skip_locked=True)
+        last_delay = func.greatest(
+            cls.scheduled_for - cls.scheduled_from,
+            literal(datetime.timedelta(minutes=1), Interval),
+            type_=Interval,
+        )
+        next_delay = func.least(
+            last_delay * 2, literal(datetime.timedelta(hours=1), Interval), type_=Interval
+        )
+
+        return (
+            update(cls)
+            .where(cls.id.in_(due))
+            .values(
+                scheduled_for=literal(now, DateTime) + next_delay,
+                scheduled_from=now,
+                acquisitions=cls.acquisitions + 1,
+            )
+            .returning(cls)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def acquire_work(
+        cls,
+        batch_size: int,
+        now: datetime.datetime,
+        session: sqlalchemy.orm.Session | None = None,
+        lanes: Collection[str] | None = None,
+        exclude_lanes: Collection[str] = (),
+    ) -> list["ProcessRequest"]:
         with contextlib.ExitStack() as stack:
             if session is None:
                 session = stack.enter_context(Session())
-            items: list[ProcessRequest] = list(
-                session.scalars(
-                    select(cls)
-                    .where(cls.scheduled_for < now)
-                    .order_by(cls.scheduled_for)
-                    .limit(batch_size)
-                    .with_for_update()
-                ).all()
+            items = list(
+                session.scalars(cls.acquire_work_stmt(batch_size, now, lanes, exclude_lanes)).all()
             )
-
-            for item in items:
-                item.scheduled_for = item.next_schedule(now)
-                item.scheduled_from = now
-                session.add(item)
-
             session.commit()
 
-            return items
+        return items
 
     def mark_completed_stmt(self) -> sqlalchemy.UpdateBase:
         return delete(type(self)).where(
             type(self).id == self.id, type(self).created_at <= self.created_at
         )
 
+    @classmethod
+    def acquired_values(cls, items: Collection["ProcessRequest"]) -> sqlalchemy.Values:
+        return sqlalchemy.values(
+            sqlalchemy.column("id", Integer),
+            sqlalchemy.column("created_at", DateTime),
+            name="acquired",
+        ).data([(item.id, item.created_at) for item in items])
+
+    @classmethod
+    def mark_completed_batch_stmt(
+        cls, items: Collection["ProcessRequest"]
+    ) -> sqlalchemy.UpdateBase:
+        """
+        mark_completed_stmt for many items in one statement.
+        """
+        acquired = cls.acquired_values(items)
+        return delete(cls).where(cls.id == acquired.c.id, cls.created_at <= acquired.c.created_at)
+
+    @classmethod
+    def renew_leases_stmt(
+        cls, items: Collection["ProcessRequest"], now: datetime.datetime, lease: datetime.timedelta
+    ) -> sqlalchemy.UpdateBase:
+        """
+        Pushes the scheduled_for of items still being worked on to at least `lease` from now, so
+        that no other worker acquires them in the meantime.  Items that were rescheduled since they
+        were acquired are left alone, so that the new request is picked up on time.
+        """
+        acquired = cls.acquired_values(items)
+        return (
+            update(cls)
+            .where(cls.id == acquired.c.id, cls.created_at <= acquired.c.created_at)
+            .values(scheduled_for=func.greatest(cls.scheduled_for, now + lease))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def coalesce_schedule(pending: dict | None, row: dict) -> dict:
+    """
+    Merges a schedule_values row into one pending for the same name, as schedule_stmt would if it
+    upserted one after the other: the later payload, lane and expected duration win, and the work is
+    due at the earliest of the two.
+    """
+    if pending is None:
+        return row
+    scheduled_for = min(pending["scheduled_for"], row["scheduled_for"])
+    return {
+        **row,
+        "scheduled_for": scheduled_for,
+        "scheduled_from": scheduled_for - (row["scheduled_for"] - row["scheduled_from"]),
+    }
+
+
+class ScheduleBuffer:
+    """
+    Buffers ProcessRequest schedules for up to `window` seconds, coalescing those of the same name,
+    and writes them in a single multi-row upsert, so that producers that schedule the same work over
+    and over cost one write per window rather than one per call.
+
+    Buffered schedules are lost if the process dies before they are flushed.  Callers that need the
+    work to be durable once they return, or to commit it with other changes, should execute
+    schedule_stmt in their own transaction instead.
+    """
+
+    def __init__(self, window: float = 1.0, max_size: int = 500):
+        self.window = window
+        self.max_size = max_size
+        self.pending: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    def schedule(
+        self,
+        name: str,
+        payload: dict | str | bytes | BaseModel,
+        when: datetime.datetime,
+        expected_duration: datetime.timedelta = datetime.timedelta(seconds=0),
+        lane: str = DEFAULT_LANE,
+    ):
+        row = ProcessRequest.schedule_values(name, payload, when, expected_duration, lane)
+        with self._lock:
+            self.pending[name] = coalesce_schedule(self.pending.get(name), row)
+            full = len(self.pending) >= self.max_size
+            if not full:
+                self._start_timer()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+
+        try:
+            with Session() as session:
+                session.execute(ProcessRequest.schedule_many_stmt(list(pending.values())))
+                session.commit()
+        except Exception:
+            logger.exception(f"Failed to write {len(pending)} process request schedules")
+            # Kept for the next flush, behind anything scheduled since
+            with self._lock:
+                for name, row in pending.items():
+                    self.pending[name] = coalesce_schedule(row, self.pending.get(name, row))
+                self._start_timer()
+            return
+
+        sentry_sdk.metrics.distribution("seer.process_request.schedule_batch", len(pending))
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
 
 class DbRepositoryInfo(Base):
     __tablename__ = "repositories"
@@ -226,25 +618,107 @@ class DbDocumentTombstone(Base):
     )
 
 
+class HalfVector(UserDefinedType):
+    """
+    pgvector's half precision `halfvec` type.  Only used to cast `Vector` columns and parameters in
+    queries.
+    """
+
+    cache_ok = True
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"HALFVEC({self.dim})"
+
+
+class Bit(UserDefinedType):
+    """
+    Postgres' fixed length `bit` type, which pgvector's `binary_quantize` produces.
+    """
+
+    cache_ok = True
+
+    def __init__(self, length: int):
+        self.length = length
+
+    def get_col_spec(self, **kw):
+        return f"BIT({self.length})"
+
+
+# How grouping embeddings are indexed for nearest neighbor search.  "vector" indexes the full
+# precision embeddings.  "halfvec" and "binary" index half precision and binary quantized copies of
+# them, which take a half and a 32nd of the memory, and searches re-rank their candidates by full
+# precision distance.  Only the HNSW index of the configured mode is built, so changing it requires
+# building the index of the new mode.
+GROUPING_EMBEDDING_STORAGE = os.environ.get("GROUPING_EMBEDDING_STORAGE", "vector")
+
+
+def grouping_embedding_index(storage_mode: str) -> Index:
+    if storage_mode == "vector":
+        return Index(
+            "ix_grouping_records_stacktrace_embedding_hnsw",
+            "stacktrace_embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"stacktrace_embedding": "vector_cosine_ops"},
+        )
+    if storage_mode == "halfvec":
+        return Index(
+            "ix_grouping_records_stacktrace_embedding_halfvec_hnsw",
+            text("(stacktrace_embedding::halfvec(768)) halfvec_cosine_ops"),
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+        )
+    if storage_mode == "binary":
+        return Index(
+            "ix_grouping_records_stacktrace_embedding_binary_hnsw",
+            text("(binary_quantize(stacktrace_embedding)::bit(768)) bit_hamming_ops"),
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+        )
+    raise ValueError(f"Unknown grouping embedding storage mode {storage_mode!r}")
+
+
+# grouping_records is hash partitioned by project so that nearest neighbor searches, which are
+# always filtered by project, only walk the HNSW graph of a single partition instead of one spanning
+# every project.
+GROUPING_RECORDS_PARTITIONS = 32
+
+
 class DbGroupingRecord(Base):
     __tablename__ = "grouping_records"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     group_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
-    project_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    project_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
     message: Mapped[str] = mapped_column(String, nullable=False)
     stacktrace_embedding: Mapped[Vector] = mapped_column(Vector(768), nullable=False)
     stacktrace_hash: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
 
     __table_args__ = (
+        grouping_embedding_index(GROUPING_EMBEDDING_STORAGE),
         Index(
-            "ix_grouping_records_stacktrace_embedding_hnsw",
-            "stacktrace_embedding",
-            postgresql_using="hnsw",
-            postgresql_with={"m": 16, "ef_construction": 64},
-            postgresql_ops={"stacktrace_embedding": "vector_cosine_ops"},
+            "ix_grouping_records_project_id_group_id",
+            "project_id",
+            "group_id",
+            unique=True,
         ),
         Index(
-            "ix_grouping_records_project_id",
+            "ix_grouping_records_project_id_stacktrace_hash",
             "project_id",
+            "stacktrace_hash",
+        ),
+        {"postgresql_partition_by": "HASH (project_id)"},
+    )
+
+
+for remainder in range(GROUPING_RECORDS_PARTITIONS):
+    event.listen(
+        DbGroupingRecord.__table__,
+        "after_create",
+        DDL(
+            f"CREATE TABLE grouping_records_p{remainder} PARTITION OF grouping_records "
+            f"FOR VALUES WITH (MODULUS {GROUPING_RECORDS_PARTITIONS}, REMAINDER {remainder})"
         ),
     )
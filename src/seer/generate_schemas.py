@@ -129,7 +129,7 @@ if __name__ == "__main__":
                         },
                     }
                 }
-                for url_rule, view_function, request, response in view_functions
+                for url_rule, view_function, request, response, _ in view_functions
             },
         )
     )
@@ -0,0 +1,64 @@
+import asyncio
+import datetime
+import logging
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from seer.db import BULK_LANE, ProcessRequest
+from seer.grouping.grouping import GroupingBackfillRecord
+from seer.task_factory import AsyncTaskFactory, async_task_factory
+
+logger = logging.getLogger("grouping")
+
+PROCESS_REQUEST_PREFIX = "grouping-backfill:"
+
+
+class GroupingBackfillRequest(BaseModel):
+    """
+    One page of the records of existing issues to add to grouping.  Pages are identified by their
+    backfill and page number, so resending a page replaces its payload instead of scheduling it
+    twice.
+    """
+
+    backfill_id: str = Field(min_length=1, max_length=64)
+    page: int = Field(ge=0)
+    records: List[GroupingBackfillRecord]
+
+    @property
+    def process_request_name(self) -> str:
+        return f"{PROCESS_REQUEST_PREFIX}{self.backfill_id}:{self.page}"
+
+
+class GroupingBackfillResponse(BaseModel):
+    scheduled: bool
+
+
+def schedule_backfill(session, request: GroupingBackfillRequest):
+    """
+    Schedules the page to be embedded and inserted by the async worker.
+    """
+    session.execute(
+        ProcessRequest.schedule_stmt(
+            request.process_request_name, request, datetime.datetime.utcnow(), lane=BULK_LANE
+        )
+    )
+
+
+@async_task_factory
+class GroupingBackfillTask(AsyncTaskFactory):
+    def matches(self, process_request: ProcessRequest) -> bool:
+        return process_request.name.startswith(PROCESS_REQUEST_PREFIX)
+
+    async def invoke(self, process_request: ProcessRequest):
+        from seer.inference_models import grouping_lookup
+
+        request = GroupingBackfillRequest.model_validate(process_request.payload)
+        loop = asyncio.get_running_loop()
+        inserted = await loop.run_in_executor(
+            None, lambda: grouping_lookup().backfill(request.records)
+        )
+        logger.info(
+            f"Backfilled {inserted} of {len(request.records)} grouping records "
+            f"of {process_request.name}"
+        )
@@ -0,0 +1,147 @@
+"""
+Compares the recall and latency of grouping's HNSW searches against exact nearest neighbor search,
+for each embedding storage mode and search breadth (hnsw.ef_search).
+
+    python src/seer/grouping/benchmark.py --projects 10 --queries 50 --k 5 --ef-search 40 100 400
+
+Each storage mode is run with the adaptive breadth GroupingLookup uses, and with each fixed breadth
+given.  Only the HNSW index of the configured GROUPING_EMBEDDING_STORAGE mode is built, so other
+modes given with --storage-modes are only meaningful once their index has been created.  Ground
+truth is computed exactly in memory from each sampled project's embeddings.  Each query is an
+existing record of the project, excluded from its own results the same way a grouping request
+excludes its own group.
+"""
+import argparse
+import dataclasses
+import statistics
+import time
+from typing import get_args
+
+import numpy as np
+from sqlalchemy import func, select
+
+from seer.db import GROUPING_EMBEDDING_STORAGE, DbGroupingRecord, Session
+from seer.grouping.grouping import (
+    PROJECT_SIZE_QUERY,
+    EmbeddingStorageMode,
+    ef_search,
+    index_limit,
+    nearest_neighbors_stmt,
+)
+from seer.grouping.vector_index import normalize, search_vectors
+
+
+@dataclasses.dataclass
+class SearchResult:
+    storage_mode: EmbeddingStorageMode
+    ef_search: int | None
+    recalls: list[float] = dataclasses.field(default_factory=list)
+    latencies: list[float] = dataclasses.field(default_factory=list)
+
+    def summary(self) -> str:
+        latencies = sorted(self.latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        return (
+            f"{self.storage_mode:>8}  ef_search={self.ef_search or 'adaptive':>8}  "
+            f"recall@k={statistics.mean(self.recalls):.4f}  "
+            f"p50={statistics.median(latencies) * 1000:.2f}ms  p95={p95 * 1000:.2f}ms"
+        )
+
+
+def sample_projects(session, count: int, min_records: int) -> list[int]:
+    size = func.count().label("size")
+    return list(
+        session.scalars(
+            select(DbGroupingRecord.project_id)
+            .group_by(DbGroupingRecord.project_id)
+            .having(size >= min_records)
+            .order_by(size.desc())
+            .limit(count)
+        )
+    )
+
+
+def run(
+    projects: int,
+    queries: int,
+    k: int,
+    min_records: int,
+    seed: int,
+    ef_searches: list[int],
+    storage_modes: list[EmbeddingStorageMode],
+):
+    rng = np.random.default_rng(seed)
+    results = [
+        SearchResult(mode, breadth) for mode in storage_modes for breadth in [None, *ef_searches]
+    ]
+
+    with Session() as session:
+        for project_id in sample_projects(session, projects, min_records):
+            rows = session.execute(
+                select(DbGroupingRecord.group_id, DbGroupingRecord.stacktrace_embedding).where(
+                    DbGroupingRecord.project_id == project_id,
+                    DbGroupingRecord.group_id.isnot(None),
+                )
+            ).all()
+            group_ids = np.array([row.group_id for row in rows], dtype=np.int64)
+            embeddings = normalize(np.array([row.stacktrace_embedding for row in rows]))
+            messages = [""] * len(rows)
+            project_size, partition_size = session.execute(
+                PROJECT_SIZE_QUERY, {"project_id": project_id}
+            ).one()
+
+            for i in rng.choice(len(rows), size=min(queries, len(rows)), replace=False):
+                query = np.asarray(rows[i].stacktrace_embedding, dtype=np.float32)
+                exact = {
+                    group_id
+                    for group_id, _, _ in search_vectors(
+                        group_ids, messages, embeddings, query, k, 2.0, int(group_ids[i])
+                    )
+                }
+
+                for result in results:
+                    breadth = result.ef_search or ef_search(
+                        index_limit(k, result.storage_mode), project_size, partition_size or 0
+                    )
+                    stmt = nearest_neighbors_stmt(
+                        project_id, int(group_ids[i]), query, k, result.storage_mode, breadth
+                    )
+                    start = time.perf_counter()
+                    found = set(session.scalars(stmt))
+                    result.latencies.append(time.perf_counter() - start)
+                    result.recalls.append(len(found & exact) / len(exact) if exact else 1.0)
+
+    for result in results:
+        if result.recalls:
+            print(result.summary())
+
+
+if __name__ == "__main__":
+    from seer.bootup import bootup
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-records", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[40, 100, 400])
+    parser.add_argument(
+        "--storage-modes",
+        nargs="*",
+        choices=get_args(EmbeddingStorageMode),
+        default=[GROUPING_EMBEDDING_STORAGE],
+    )
+    args = parser.parse_args()
+
+    app = bootup(__name__, init_db=True)
+    with app.app_context():
+        run(
+            args.projects,
+            args.queries,
+            args.k,
+            args.min_records,
+            args.seed,
+            args.ef_search,
+            args.storage_modes,
+        )
@@ -1,18 +1,184 @@
-import difflib
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional
+import math
+import time
+from typing import Dict, List, Literal, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import sentry_sdk
+import sentry_sdk.metrics
 import torch
+from pgvector.sqlalchemy import Vector  # type: ignore
 from pydantic import BaseModel, ValidationInfo, field_validator
 from sentence_transformers import SentenceTransformer
+from sqlalchemy import Float, cast, func, literal, select, text, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
 
-from seer.db import DbGroupingRecord, Session
+from seer.db import AsyncSession, Bit, DbGroupingRecord, HalfVector, Session, replica_router
+from seer.grouping.message_similarity import MessageMetric, message_similarities
+from seer.grouping.stacktrace import canonicalize_stacktrace
+from seer.grouping.vector_index import GroupingVectorIndex
+from seer.inference_executor import DEFAULT_MAX_BATCH_SIZE, InferenceExecutor, encode_batch
 
 logger = logging.getLogger("grouping")
 
+# Backfilled records are written this many at a time, and embedded in model batches of the encode
+# executor's size.
+BACKFILL_BATCH_SIZE = 256
+
+# Neighbors further than this stacktrace distance, or the request's threshold if it is larger, are
+# never returned.
+MAX_NEIGHBOR_DISTANCE = 0.15
+
+# The breadth of each HNSW search, pgvector's hnsw.ef_search, is scaled with the number of rows the
+# search needs to produce and with how much of the searched partition belongs to other projects,
+# since those rows are only filtered out after the graph has been walked.  Project and partition
+# sizes are re-read every PROJECT_SIZE_TTL seconds.
+MIN_EF_SEARCH = 40
+MAX_EF_SEARCH = 1_000
+EF_SEARCH_PER_ROW = 10
+PROJECT_SIZE_TTL = 600
+PROJECT_SIZE_CACHE_SIZE = 10_000
+
+PROJECT_SIZE_QUERY = text(
+    """
+    SELECT
+        (SELECT count(*) FROM grouping_records WHERE project_id = :project_id),
+        (
+            SELECT reltuples FROM pg_class
+            WHERE oid = (
+                SELECT tableoid FROM grouping_records WHERE project_id = :project_id LIMIT 1
+            )
+        )
+    """
+)
+
+
+EMBEDDING_DIMENSIONS = 768
+
+# How embeddings are searched.  "vector" searches the full precision HNSW index.  "halfvec" and
+# "binary" search the much smaller half precision and binary quantized HNSW indexes, then re-rank
+# RERANK_FACTOR times k of their candidates by full precision distance.  Only the index of
+# GROUPING_EMBEDDING_STORAGE is built, see DbGroupingRecord.
+EmbeddingStorageMode = Literal["vector", "halfvec", "binary"]
+RERANK_FACTOR = 4
+MIN_RERANK_CANDIDATES = 40
+
+
+def quantized_distance(storage_mode: EmbeddingStorageMode, embedding: np.ndarray):
+    query_embedding = literal(embedding, Vector(EMBEDDING_DIMENSIONS))
+    if storage_mode == "halfvec":
+        return cast(DbGroupingRecord.stacktrace_embedding, HalfVector(EMBEDDING_DIMENSIONS)).op(
+            "<=>", return_type=Float
+        )(cast(query_embedding, HalfVector(EMBEDDING_DIMENSIONS)))
+    if storage_mode == "binary":
+        return cast(
+            func.binary_quantize(DbGroupingRecord.stacktrace_embedding), Bit(EMBEDDING_DIMENSIONS)
+        ).op("<~>", return_type=Float)(
+            cast(func.binary_quantize(query_embedding), Bit(EMBEDDING_DIMENSIONS))
+        )
+    raise ValueError(f"Embeddings are not quantized in storage mode {storage_mode}")
+
+
+def index_limit(k: int, storage_mode: EmbeddingStorageMode) -> int:
+    """
+    The number of rows the HNSW index of the storage mode is asked for when searching for k
+    neighbors.
+    """
+    if storage_mode == "vector":
+        return k
+    return max(k * RERANK_FACTOR, MIN_RERANK_CANDIDATES)
+
+
+def ef_search(limit: int, project_size: int, partition_size: int) -> int:
+    """
+    The HNSW search breadth for finding `limit` rows of a project of `project_size` records in a
+    partition of `partition_size` records.
+    """
+    project_share = max(project_size, 1) / max(partition_size, project_size, 1)
+    breadth = math.ceil(limit * EF_SEARCH_PER_ROW / project_share)
+    return min(max(breadth, MIN_EF_SEARCH), MAX_EF_SEARCH)
+
+
+def nearest_neighbors_stmt(
+    project_id: int,
+    exclude_group_id: int,
+    embedding: np.ndarray,
+    k: int,
+    storage_mode: EmbeddingStorageMode = "vector",
+    ef_search: Optional[int] = None,
+):
+    """
+    Selects the group id, message and full precision stacktrace distance of the k nearest records of
+    the project, closest first, searching the index of the given storage mode.
+
+    With `ef_search`, the statement also sets hnsw.ef_search for the rest of the transaction.  It is
+    set in a one row subquery that the search is laterally joined to, so it is evaluated before the
+    HNSW index is walked, without a separate statement.
+    """
+    filters = (
+        DbGroupingRecord.project_id == project_id,
+        DbGroupingRecord.group_id != exclude_group_id,
+    )
+    if storage_mode == "vector":
+        distance = DbGroupingRecord.stacktrace_embedding.cosine_distance(embedding).label(
+            "distance"
+        )
+        stmt = (
+            select(DbGroupingRecord.group_id, DbGroupingRecord.message, distance)
+            .where(*filters)
+            .order_by(distance)
+            .limit(k)
+        )
+    else:
+        candidates = (
+            select(
+                DbGroupingRecord.group_id,
+                DbGroupingRecord.message,
+                DbGroupingRecord.stacktrace_embedding,
+            )
+            .where(*filters)
+            .order_by(quantized_distance(storage_mode, embedding))
+            .limit(index_limit(k, storage_mode))
+            .subquery("candidates")
+        )
+        distance = candidates.c.stacktrace_embedding.cosine_distance(embedding).label("distance")
+        stmt = (
+            select(candidates.c.group_id, candidates.c.message, distance)
+            .order_by(distance)
+            .limit(k)
+        )
+
+    if ef_search is None:
+        return stmt
+
+    search_breadth = select(
+        func.set_config("hnsw.ef_search", str(ef_search), True).label("ef_search")
+    ).subquery("search_breadth")
+    neighbors = stmt.where(search_breadth.c.ef_search.isnot(None)).lateral("search")
+    return (
+        select(neighbors.c.group_id, neighbors.c.message, neighbors.c.distance)
+        .select_from(search_breadth.join(neighbors, true()))
+        .order_by(neighbors.c.distance)
+    )
+
+
+def hash_stacktrace(stacktrace: str) -> str:
+    """
+    Hashes a canonicalized stacktrace, so that exact duplicates can be found without embedding them.
+    """
+    return hashlib.md5(stacktrace.encode("utf-8")).hexdigest()
+
+
+def max_neighbor_distance(threshold: float) -> float:
+    """
+    The largest stacktrace distance of the neighbors returned for a request with the given grouping
+    threshold.
+    """
+    return max(MAX_NEIGHBOR_DISTANCE, threshold)
+
 
 class GroupingRequest(BaseModel):
     group_id: int
@@ -21,6 +187,7 @@ class GroupingRequest(BaseModel):
     message: str
     k: int = 1
     threshold: float = 0.01
+    message_metric: MessageMetric = "sequence_matcher"
 
     @field_validator("stacktrace", "message")
     @classmethod
@@ -30,11 +197,19 @@ class GroupingRequest(BaseModel):
         return v
 
 
+class GroupingBackfillRecord(BaseModel):
+    group_id: int
+    project_id: int
+    stacktrace: str
+    message: str
+
+
 class GroupingRecord(BaseModel):
     group_id: int
     project_id: int
     message: str
     stacktrace_embedding: np.ndarray
+    stacktrace_hash: Optional[str] = None
 
     def to_db_model(self) -> DbGroupingRecord:
         return DbGroupingRecord(
@@ -42,6 +217,7 @@ class GroupingRecord(BaseModel):
             project_id=self.project_id,
             message=self.message,
             stacktrace_embedding=self.stacktrace_embedding,
+            stacktrace_hash=self.stacktrace_hash,
         )
 
     class Config:
@@ -67,15 +243,44 @@ class GroupingLookup:
 
     Attributes:
         model (SentenceTransformer): The sentence transformer model for encoding text.
+        vector_index (GroupingVectorIndex): Optional in-process index searched before pgvector.
+        storage_mode (EmbeddingStorageMode): Which pgvector index nearest neighbors are searched
+            with.
+        executor (InferenceExecutor): Optional executor that encodes are run on, shared by the
+            models of the process.
+        canonical_embeddings (bool): Whether stacktraces are embedded canonicalized, rather than as
+            received.
 
     """
 
-    def __init__(self, model_path: str, data_path: str):
+    def __init__(
+        self,
+        model_path: str,
+        data_path: str,
+        vector_index: Optional[GroupingVectorIndex] = None,
+        storage_mode: EmbeddingStorageMode = "vector",
+        executor: Optional[InferenceExecutor] = None,
+        canonical_embeddings: bool = False,
+    ):
         """
         Initializes the GroupingLookup with the sentence transformer model.
 
         :param model_path: Path to the sentence transformer model.
+        :param vector_index: In-process index of small projects, consulted before pgvector when
+            provided.
+        :param storage_mode: Search the full precision, half precision or binary quantized embedding
+            index.
+        :param executor: Executor to run encodes on, instead of on the calling thread.
+        :param canonical_embeddings: Embed canonicalized stacktraces.  Stacktraces are always hashed
+            canonicalized, but existing records were embedded from the stacktrace as received, and
+            their distances to canonicalized embeddings are not comparable until they are
+            re-embedded.
         """
+        self.vector_index = vector_index
+        self.canonical_embeddings = canonical_embeddings
+        self.storage_mode = storage_mode
+        self.executor = executor
+        self.project_sizes: Dict[int, Tuple[float, int, int]] = {}
         model_device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
         self.model = SentenceTransformer(
             model_path,
@@ -121,6 +326,15 @@ class GroupingLookup:
                     session.add(new_record)
                 session.commit()
 
+    def embedded_stacktrace(self, stacktrace: str, canonical_stacktrace: str) -> str:
+        """
+        The text a stacktrace is embedded from, depending on canonical_embeddings.
+
+        :param stacktrace: The stacktrace as received.
+        :param canonical_stacktrace: The canonicalized stacktrace.
+        """
+        return canonical_stacktrace if self.canonical_embeddings else stacktrace
+
     def encode_text(self, stacktrace: str) -> np.ndarray:
         """
         Encodes the stacktrace using the sentence transformer model.
@@ -128,50 +342,171 @@ class GroupingLookup:
         :param stacktrace: The stacktrace to encode.
         :return: The embedding of the stacktrace.
         """
-        return self.model.encode(stacktrace)
+        if self.executor is not None:
+            return self.executor.encode(self.model, stacktrace)
+        return encode_batch(self.model, [stacktrace])[0]
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes many texts using the sentence transformer model, in forward passes of a bounded
+        number of texts.
+
+        :param texts: The texts to encode.
+        :return: The embedding of each text.
+        """
+        if self.executor is not None:
+            return self.executor.encode_many(self.model, texts)
+        return encode_batch(self.model, texts, batch_size=DEFAULT_MAX_BATCH_SIZE)
 
     def get_nearest_neighbors(self, issue: GroupingRequest) -> SimilarityResponse:
         """
-        Retrieves the k nearest neighbors for a stacktrace within the same project and determines if they should be grouped.
-        If no records should be grouped, inserts the request as a new GroupingRecord into the database.
+        Retrieves the k nearest neighbors for a stacktrace within the same project and determines if
+        they should be grouped.  If no records should be grouped, inserts the request as a new
+        GroupingRecord into the database.  Exact duplicates are looked up first, in the same
+        transaction as the nearest neighbor search.
 
         :param issue: The issue containing the stacktrace, similarity threshold, and number of nearest neighbors to find (k).
         :return: A SimilarityResponse object containing a list of GroupingResponse objects with the nearest group IDs,
                  stacktrace similarity scores, message similarity scores, and grouping flags.
         """
-        embedding = self.encode_text(issue.stacktrace).astype("float32")
+        stacktrace = canonicalize_stacktrace(issue.stacktrace)
+        stacktrace_hash = hash_stacktrace(stacktrace)
         with Session() as session:
-            results = (
-                session.query(
-                    DbGroupingRecord,
-                    DbGroupingRecord.stacktrace_embedding.cosine_distance(embedding).label(
-                        "distance"
-                    ),
+            results = self.query_exact_duplicates_and_insert(session, issue, stacktrace_hash)
+            if not self.record_exact_duplicate(results):
+                embedding = self.encode_text(
+                    self.embedded_stacktrace(issue.stacktrace, stacktrace)
+                ).astype("float32")
+                results = self.query_neighbors_and_insert(
+                    session, issue, embedding, stacktrace_hash
                 )
-                .filter(
-                    DbGroupingRecord.project_id == issue.project_id,
-                    DbGroupingRecord.stacktrace_embedding.cosine_distance(embedding) <= 0.15,
-                    DbGroupingRecord.group_id != issue.group_id,
+            session.commit()
+
+        return self.build_similarity_response(issue, results)
+
+    async def get_nearest_neighbors_async(self, issue: GroupingRequest) -> SimilarityResponse:
+        """
+        Same as get_nearest_neighbors, but runs its queries on an AsyncSession, and the encode and
+        the search of the read replica, whose sessions are synchronous, on an executor, so that the
+        event loop can serve other requests while any of them is in progress.
+        """
+        stacktrace = canonicalize_stacktrace(issue.stacktrace)
+        stacktrace_hash = hash_stacktrace(stacktrace)
+        async with AsyncSession() as session:
+            results = await session.run_sync(
+                lambda session: self.query_exact_duplicates_and_insert(
+                    session, issue, stacktrace_hash
                 )
-                .order_by("distance")
-                .limit(issue.k)
-                .all()
             )
+            if not self.record_exact_duplicate(results):
+                loop = asyncio.get_running_loop()
+                embedding = (
+                    await loop.run_in_executor(
+                        None,
+                        self.encode_text,
+                        self.embedded_stacktrace(issue.stacktrace, stacktrace),
+                    )
+                ).astype("float32")
 
-            self.insert_new_grouping_record(session, issue, embedding)
+                neighbors = self.query_vector_index(issue, embedding)
+                if neighbors is None:
+                    neighbors = await loop.run_in_executor(
+                        None, self.query_replica, issue, embedding
+                    )
+                if neighbors is None:
+                    results = await session.run_sync(
+                        lambda session: self.query_pgvector_and_insert(
+                            session, issue, embedding, stacktrace_hash
+                        )
+                    )
+                else:
+                    await session.run_sync(
+                        lambda session: self.insert_new_grouping_record(
+                            session, issue, embedding, stacktrace_hash
+                        )
+                    )
+                    results = neighbors
+            await session.commit()
 
-            session.commit()
+        return self.build_similarity_response(issue, results)
+
+    def record_exact_duplicate(self, results: List[Tuple[int, str, float]]) -> bool:
+        sentry_sdk.metrics.incr(
+            "seer.grouping.exact_duplicate", tags={"hit": "true" if results else "false"}
+        )
+        return bool(results)
+
+    def query_neighbors_and_insert(
+        self,
+        session,
+        issue: GroupingRequest,
+        embedding: np.ndarray,
+        stacktrace_hash: str,
+    ) -> List[Tuple[int, str, float]]:
+        """
+        Finds the k nearest records of the issue's project, with the in-process index, the read
+        replica or the primary, in that order of preference, and inserts the issue as a new
+        GroupingRecord.
+
+        :param session: The database session on the primary.
+        :param issue: The issue whose nearest neighbors are looked up.
+        :param embedding: The embedding of the stacktrace.
+        :param stacktrace_hash: The hash of the stacktrace.
+        :return: The group id, message and stacktrace distance of each neighbor, closest first.
+        """
+        results = self.query_vector_index(issue, embedding)
+        if results is None:
+            results = self.query_replica(issue, embedding)
+        if results is None:
+            return self.query_pgvector_and_insert(session, issue, embedding, stacktrace_hash)
+
+        self.insert_new_grouping_record(session, issue, embedding, stacktrace_hash)
+        return results
+
+    def query_vector_index(
+        self, issue: GroupingRequest, embedding: np.ndarray
+    ) -> Optional[List[Tuple[int, str, float]]]:
+        """
+        Finds the k nearest records of the issue's project with the in-process index.
+
+        :param issue: The issue whose nearest neighbors are looked up.
+        :param embedding: The embedding of the stacktrace.
+        :return: The group id, message and stacktrace distance of each neighbor, closest first, or
+                 None if there is no in-process index or it does not hold the project.
+        """
+        if self.vector_index is None:
+            return None
+        return self.vector_index.search(
+            issue.project_id,
+            embedding,
+            issue.k,
+            max_neighbor_distance(issue.threshold),
+            issue.group_id,
+        )
 
+    def build_similarity_response(
+        self, issue: GroupingRequest, results: List[Tuple[int, str, float]]
+    ) -> SimilarityResponse:
+        """
+        Scores the messages of the neighbors found for the issue and decides which of them it should
+        be grouped with.
+
+        :param issue: The issue the neighbors were found for.
+        :param results: The group id, message and stacktrace distance of each neighbor, closest
+            first.
+        """
         similarity_response = SimilarityResponse(responses=[])
-        for record, distance in results:
-            message_similarity_score = difflib.SequenceMatcher(
-                None, issue.message, record.message
-            ).ratio()
+        message_similarity_scores = message_similarities(
+            issue.message_metric, issue.message, [message for _, message, _ in results]
+        )
+        for (group_id, _, distance), message_similarity_score in zip(
+            results, message_similarity_scores
+        ):
             should_group = distance <= issue.threshold
 
             similarity_response.responses.append(
                 GroupingResponse(
-                    parent_group_id=record.group_id,
+                    parent_group_id=group_id,
                     stacktrace_distance=distance,
                     message_distance=1.0 - message_similarity_score,
                     should_group=should_group,
@@ -180,20 +515,258 @@ class GroupingLookup:
 
         return similarity_response
 
-    def insert_new_grouping_record(self, session, issue: GroupingRequest, embedding: np.ndarray):
+    def query_exact_duplicates_and_insert(
+        self, session, issue: GroupingRequest, stacktrace_hash: str
+    ) -> List[Tuple[int, str, float]]:
         """
-        Inserts a new GroupingRecord into the database if the group_id does not already exist.
+        Finds up to k records of the issue's project whose stacktrace hashes the same as the
+        issue's, and if there are any, inserts the issue as a new GroupingRecord that reuses the
+        embedding of the oldest of them, in a single statement.  When nothing matches, nothing is
+        inserted and the issue needs to be embedded.
+
+        :param session: The database session.
+        :param issue: The issue whose duplicates are looked up.
+        :param stacktrace_hash: The hash of the issue's stacktrace.
+        :return: The group id, message and a stacktrace distance of 0 for each duplicate, oldest
+            first.
+        """
+        duplicates = (
+            select(DbGroupingRecord.id, DbGroupingRecord.group_id, DbGroupingRecord.message)
+            .where(
+                DbGroupingRecord.project_id == issue.project_id,
+                DbGroupingRecord.stacktrace_hash == stacktrace_hash,
+                DbGroupingRecord.group_id != issue.group_id,
+            )
+            .order_by(DbGroupingRecord.id)
+            .limit(issue.k)
+            .cte("duplicates")
+        )
+        new_record = (
+            insert(DbGroupingRecord)
+            .from_select(
+                ["group_id", "project_id", "message", "stacktrace_embedding", "stacktrace_hash"],
+                select(
+                    literal(issue.group_id),
+                    literal(issue.project_id),
+                    literal(issue.message),
+                    DbGroupingRecord.stacktrace_embedding,
+                    DbGroupingRecord.stacktrace_hash,
+                ).where(DbGroupingRecord.id == select(func.min(duplicates.c.id)).scalar_subquery()),
+            )
+            .on_conflict_do_nothing(
+                index_elements=[DbGroupingRecord.project_id, DbGroupingRecord.group_id]
+            )
+            .returning(DbGroupingRecord.id)
+            .cte("new_record")
+        )
+        rows = session.execute(
+            select(duplicates.c.group_id, duplicates.c.message)
+            .order_by(duplicates.c.id)
+            .add_cte(new_record)
+        ).all()
+        return [(group_id, message, 0.0) for group_id, message in rows]
+
+    def query_pgvector_and_insert(
+        self, session, issue: GroupingRequest, embedding: np.ndarray, stacktrace_hash: str
+    ) -> List[Tuple[int, str, float]]:
+        """
+        Finds the k nearest records of the issue's project with the pgvector HNSW index of the
+        storage mode and inserts the issue as a new GroupingRecord, in a single statement.
+
+        The neighbors are selected from the snapshot taken before the insert, so the new record is
+        never its own neighbor.  Ordering by the distance and filtering it afterwards computes it
+        once per row and keeps the query in the `ORDER BY ... LIMIT` shape that the HNSW index
+        serves; it returns the same rows as filtering first, since every row within the maximum
+        distance sorts before those beyond it.
+
+        :param session: The database session.
+        :param issue: The issue whose nearest neighbors are looked up.
+        :param embedding: The embedding of the stacktrace.
+        :param stacktrace_hash: The hash of the stacktrace.
+        :return: The group id, message and stacktrace distance of each neighbor, closest first.
+        """
+        neighbors = nearest_neighbors_stmt(
+            issue.project_id,
+            issue.group_id,
+            embedding,
+            issue.k,
+            self.storage_mode,
+            self.search_breadth(session, issue),
+        ).cte("neighbors")
+        new_record = (
+            self.insert_new_grouping_record_stmt(issue, embedding, stacktrace_hash)
+            .returning(DbGroupingRecord.id)
+            .cte("new_record")
+        )
+        rows = session.execute(
+            select(neighbors.c.group_id, neighbors.c.message, neighbors.c.distance)
+            .where(neighbors.c.distance <= max_neighbor_distance(issue.threshold))
+            .order_by(neighbors.c.distance)
+            .add_cte(new_record)
+        ).all()
+        return [(group_id, message, distance) for group_id, message, distance in rows]
+
+    def search_breadth(self, session, issue: GroupingRequest) -> int:
+        """
+        The hnsw.ef_search needed to find the issue's k neighbors in its project.
+
+        :param session: The database session.
+        :param issue: The issue whose nearest neighbors are about to be looked up.
+        """
+        project_size, partition_size = self.project_size(session, issue.project_id)
+        return ef_search(index_limit(issue.k, self.storage_mode), project_size, partition_size)
+
+    def project_size(self, session, project_id: int) -> Tuple[int, int]:
+        """
+        Returns the number of records of the project and of the partition holding it, read at most
+        once every PROJECT_SIZE_TTL seconds.  The partition size is Postgres' estimate as of its
+        last analyze.
 
         :param session: The database session.
+        :param project_id: The project to size.
+        """
+        now = time.monotonic()
+        cached = self.project_sizes.get(project_id)
+        if cached is not None and now - cached[0] < PROJECT_SIZE_TTL:
+            return cached[1], cached[2]
+
+        project_size, partition_size = session.execute(
+            PROJECT_SIZE_QUERY, {"project_id": project_id}
+        ).one()
+        partition_size = max(int(partition_size or 0), 0)
+        if len(self.project_sizes) >= PROJECT_SIZE_CACHE_SIZE:
+            self.project_sizes.clear()
+        self.project_sizes[project_id] = (now, project_size, partition_size)
+        return project_size, partition_size
+
+    def query_replica(
+        self, issue: GroupingRequest, embedding: np.ndarray
+    ) -> Optional[List[Tuple[int, str, float]]]:
+        """
+        Finds the k nearest records of the issue's project on the read replica, without inserting
+        the issue.
+
+        :param issue: The issue whose nearest neighbors are looked up.
+        :param embedding: The embedding of the stacktrace.
+        :return: The group id, message and stacktrace distance of each neighbor, closest first, or
+                 None if there is no replica or it is lagging, and the search should run on the
+                 primary.
+        """
+        replica_session = replica_router.session()
+        if replica_session is None:
+            return None
+
+        with replica_session as session:
+            neighbors = nearest_neighbors_stmt(
+                issue.project_id,
+                issue.group_id,
+                embedding,
+                issue.k,
+                self.storage_mode,
+                self.search_breadth(session, issue),
+            ).subquery("neighbors")
+            rows = session.execute(
+                select(neighbors.c.group_id, neighbors.c.message, neighbors.c.distance)
+                .where(neighbors.c.distance <= max_neighbor_distance(issue.threshold))
+                .order_by(neighbors.c.distance)
+            ).all()
+        return [(group_id, message, distance) for group_id, message, distance in rows]
+
+    def insert_new_grouping_record_stmt(
+        self, issue: GroupingRequest, embedding: np.ndarray, stacktrace_hash: str
+    ):
+        """
+        Builds the statement inserting the issue as a new GroupingRecord, unless a record already
+        exists for its group.
+
         :param issue: The issue to insert as a new GroupingRecord.
         :param embedding: The embedding of the stacktrace.
+        :param stacktrace_hash: The hash of the stacktrace.
         """
-        existing_record = session.query(DbGroupingRecord).filter_by(group_id=issue.group_id).first()
-        if existing_record is None:
-            new_record = GroupingRecord(
+        return (
+            insert(DbGroupingRecord)
+            .values(
                 group_id=issue.group_id,
                 project_id=issue.project_id,
                 message=issue.message,
                 stacktrace_embedding=embedding,
-            ).to_db_model()
-            session.add(new_record)
+                stacktrace_hash=stacktrace_hash,
+            )
+            .on_conflict_do_nothing(
+                index_elements=[DbGroupingRecord.project_id, DbGroupingRecord.group_id]
+            )
+        )
+
+    def insert_new_grouping_record(
+        self, session, issue: GroupingRequest, embedding: np.ndarray, stacktrace_hash: str
+    ):
+        """
+        Inserts a new GroupingRecord into the database if the group_id does not already exist.
+
+        :param session: The database session.
+        :param issue: The issue to insert as a new GroupingRecord.
+        :param embedding: The embedding of the stacktrace.
+        :param stacktrace_hash: The hash of the stacktrace.
+        """
+        session.execute(self.insert_new_grouping_record_stmt(issue, embedding, stacktrace_hash))
+
+    def backfill(self, records: List[GroupingBackfillRecord]) -> int:
+        """
+        Embeds and inserts records of existing issues in batches of BACKFILL_BATCH_SIZE, committing
+        after each batch.  Records whose group already exists are skipped without being embedded, so
+        a backfill that was interrupted can be retried and resumes after the last committed batch.
+
+        :param records: The records to insert.
+        :return: The number of records inserted.
+        """
+        inserted = 0
+        for start in range(0, len(records), BACKFILL_BATCH_SIZE):
+            batch = records[start : start + BACKFILL_BATCH_SIZE]
+            with Session() as session:
+                existing = set(
+                    session.execute(
+                        select(DbGroupingRecord.project_id, DbGroupingRecord.group_id).where(
+                            tuple_(DbGroupingRecord.project_id, DbGroupingRecord.group_id).in_(
+                                [(record.project_id, record.group_id) for record in batch]
+                            )
+                        )
+                    ).tuples()
+                )
+                batch = [
+                    record
+                    for record in batch
+                    if (record.project_id, record.group_id) not in existing
+                ]
+                if not batch:
+                    continue
+
+                stacktraces = [canonicalize_stacktrace(record.stacktrace) for record in batch]
+                embeddings = self.encode_texts(
+                    [
+                        self.embedded_stacktrace(record.stacktrace, stacktrace)
+                        for record, stacktrace in zip(batch, stacktraces)
+                    ]
+                ).astype("float32")
+                rows = session.scalars(
+                    insert(DbGroupingRecord)
+                    .values(
+                        [
+                            dict(
+                                group_id=record.group_id,
+                                project_id=record.project_id,
+                                message=record.message,
+                                stacktrace_embedding=embedding,
+                                stacktrace_hash=hash_stacktrace(stacktrace),
+                            )
+                            for record, stacktrace, embedding in zip(batch, stacktraces, embeddings)
+                        ]
+                    )
+                    .on_conflict_do_nothing(
+                        index_elements=[DbGroupingRecord.project_id, DbGroupingRecord.group_id]
+                    )
+                    .returning(DbGroupingRecord.id)
+                ).all()
+                session.commit()
+            inserted += len(rows)
+
+        return inserted
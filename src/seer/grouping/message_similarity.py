@@ -0,0 +1,55 @@
+import difflib
+import re
+from typing import Callable, Dict, List, Literal
+
+MessageMetric = Literal["sequence_matcher", "token_jaccard"]
+
+# Messages are truncated to this many characters before they are compared.  SequenceMatcher is
+# quadratic in the message length, so this bounds the cost of a response regardless of what the
+# client sends.
+MAX_MESSAGE_LENGTH = 1024
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def sequence_matcher_similarities(message: str, others: List[str]) -> List[float]:
+    """
+    The difflib.SequenceMatcher ratio between the message and each of the others.
+    """
+    message = message[:MAX_MESSAGE_LENGTH]
+    return [
+        difflib.SequenceMatcher(None, message, other[:MAX_MESSAGE_LENGTH]).ratio()
+        for other in others
+    ]
+
+
+def _tokens(message: str) -> frozenset[str]:
+    return frozenset(_TOKEN_PATTERN.findall(message[:MAX_MESSAGE_LENGTH].lower()))
+
+
+def token_jaccard_similarities(message: str, others: List[str]) -> List[float]:
+    """
+    The Jaccard similarity between the word sets of the message and each of the others.  Linear in
+    the message lengths, and the message itself is tokenized only once.
+    """
+    tokens = _tokens(message)
+    similarities = []
+    for other in others:
+        other_tokens = _tokens(other)
+        union = len(tokens | other_tokens)
+        similarities.append(len(tokens & other_tokens) / union if union else 1.0)
+    return similarities
+
+
+MESSAGE_METRICS: Dict[str, Callable[[str, List[str]], List[float]]] = {
+    "sequence_matcher": sequence_matcher_similarities,
+    "token_jaccard": token_jaccard_similarities,
+}
+
+
+def message_similarities(metric: MessageMetric, message: str, others: List[str]) -> List[float]:
+    """
+    Scores each of the others against the message with the given metric, between 0 (unrelated) and 1
+    (identical).
+    """
+    return MESSAGE_METRICS[metric](message, others)
@@ -0,0 +1,81 @@
+import re
+from typing import List
+
+# Roughly the number of word piece tokens the grouping model attends to; lines beyond it would be
+# truncated by the model anyway.
+MAX_STACKTRACE_TOKENS = 512
+
+# Runs of up to this many lines that repeat back to back, such as the frames of a recursion, are
+# kept once.
+MAX_REPEATED_RUN = 10
+
+VOLATILE_TOKENS = [
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), "0x"),
+    (
+        re.compile(
+            r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"
+        ),
+        "<uuid>",
+    ),
+    (re.compile(r"\bline \d+"), "line"),
+    (re.compile(r"(\.\w+):\d+(:\d+)?\b"), r"\1"),
+]
+
+LIBRARY_PATH = re.compile(
+    r"site-packages|dist-packages|node_modules|/usr/lib/|/lib/python\d|<frozen |\bvendor/"
+)
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def canonicalize_stacktrace(stacktrace: str, max_tokens: int = MAX_STACKTRACE_TOKENS) -> str:
+    """
+    Reduces a stacktrace to the lines that matter for grouping, so that it is cheaper to embed and
+    so that traces differing only in noise hash the same.
+
+    Blank lines and surrounding whitespace are dropped, addresses, uuids, line and column numbers
+    are removed, and back to back repetitions of the same run of lines are kept once.  If what
+    remains is over `max_tokens`, library lines are dropped before application lines, and lines far
+    from the end, where the error is raised, before those close to it.
+    """
+    lines = []
+    for line in stacktrace.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for pattern, replacement in VOLATILE_TOKENS:
+            line = pattern.sub(replacement, line)
+        lines.append(line)
+
+    return "\n".join(truncate_lines(collapse_repeated_runs(lines), max_tokens))
+
+
+def collapse_repeated_runs(lines: List[str]) -> List[str]:
+    collapsed: List[str] = []
+    for line in lines:
+        collapsed.append(line)
+        for length in range(1, min(MAX_REPEATED_RUN, len(collapsed) // 2) + 1):
+            if collapsed[-2 * length : -length] == collapsed[-length:]:
+                del collapsed[-length:]
+                break
+    return collapsed
+
+
+def truncate_lines(lines: List[str], max_tokens: int) -> List[str]:
+    token_counts = [len(TOKEN.findall(line)) for line in lines]
+    if sum(token_counts) <= max_tokens:
+        return lines
+
+    # The last line usually holds the exception itself and is always kept.
+    by_priority = sorted(
+        range(len(lines) - 1),
+        key=lambda i: (bool(LIBRARY_PATH.search(lines[i])), len(lines) - i),
+    )
+    kept = {len(lines) - 1}
+    budget = max_tokens - token_counts[-1]
+    for i in by_priority:
+        if token_counts[i] <= budget:
+            kept.add(i)
+            budget -= token_counts[i]
+
+    return [line for i, line in enumerate(lines) if i in kept]
@@ -0,0 +1,291 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func, select
+
+from seer.db import DbGroupingRecord, Session
+
+logger = logging.getLogger("grouping")
+
+# Record ids are handed out before their transaction commits, so a record can become visible after a
+# record with a larger id has already been loaded.  Each refresh lists the ids of this many records
+# below the high-water mark and only loads those it does not hold yet.
+REFRESH_ID_OVERLAP = 1_000
+
+
+class ProjectVectors:
+    """
+    Exact, in-memory copy of the grouping records of a single project.  Embeddings are stored
+    normalized so that cosine distance reduces to a single matrix-vector product.
+
+    Rows are appended into preallocated buffers that grow geometrically, so appending is amortized
+    O(1).  Searches run against a snapshot of the first `size` rows, which later appends never write
+    to, so they do not need to hold the project lock.
+    """
+
+    def __init__(self, dimensions: int, capacity: int = 16):
+        self.size = 0
+        self.max_id = 0
+        self.refreshed_at = time.monotonic()
+        self.record_ids: set[int] = set()
+        self.group_ids = np.zeros(capacity, dtype=np.int64)
+        self.messages: list[str] = []
+        self.embeddings = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.group_ids.nbytes + self.embeddings.nbytes
+
+    def append(self, record_id: int, group_id: int, message: str, embedding: np.ndarray):
+        if record_id in self.record_ids:
+            return
+
+        if self.size == len(self.group_ids):
+            capacity = max(16, 2 * self.size)
+            self.group_ids = np.resize(self.group_ids, capacity)
+            embeddings = np.zeros((capacity, self.embeddings.shape[1]), dtype=np.float32)
+            embeddings[: self.size] = self.embeddings[: self.size]
+            self.embeddings = embeddings
+
+        self.group_ids[self.size] = group_id
+        self.embeddings[self.size] = normalize(embedding)
+        self.messages.append(message)
+        self.record_ids.add(record_id)
+        self.max_id = max(self.max_id, record_id)
+        self.size += 1
+
+    def snapshot(self) -> tuple[np.ndarray, list[str], np.ndarray]:
+        return self.group_ids[: self.size], self.messages[: self.size], self.embeddings[: self.size]
+
+    def search(
+        self, embedding: np.ndarray, k: int, max_distance: float, exclude_group_id: int
+    ) -> list[tuple[int, str, float]]:
+        with self.lock:
+            group_ids, messages, embeddings = self.snapshot()
+        return search_vectors(
+            group_ids, messages, embeddings, embedding, k, max_distance, exclude_group_id
+        )
+
+
+def search_vectors(
+    group_ids: np.ndarray,
+    messages: list[str],
+    embeddings: np.ndarray,
+    embedding: np.ndarray,
+    k: int,
+    max_distance: float,
+    exclude_group_id: int,
+) -> list[tuple[int, str, float]]:
+    if not len(group_ids):
+        return []
+
+    distances = 1.0 - embeddings @ normalize(embedding)
+    candidates = np.flatnonzero((distances <= max_distance) & (group_ids != exclude_group_id))
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(distances[candidates], k)[:k]]
+    candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+
+    return [(int(group_ids[i]), messages[i], float(distances[i])) for i in candidates]
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1.0, norms)
+
+
+def grouping_records_stmt(project_id: int):
+    return select(
+        DbGroupingRecord.id,
+        DbGroupingRecord.group_id,
+        DbGroupingRecord.message,
+        DbGroupingRecord.stacktrace_embedding,
+    ).where(
+        DbGroupingRecord.project_id == project_id,
+        DbGroupingRecord.group_id.isnot(None),
+    )
+
+
+class GroupingVectorIndex:
+    """
+    Process local cache of per project grouping embeddings, consulted before pgvector.
+
+    Projects are loaded on a background thread the first time they miss, and searched exactly with
+    numpy once loaded, without querying Postgres.  Until then, and for projects with more than
+    `max_project_size` records, callers fall back to the pgvector HNSW index.  The least recently
+    used projects are evicted once `max_bytes` of embeddings are held.
+
+    A search of a project that was last read more than `refresh_interval` seconds ago schedules it
+    to be refreshed, on the same background thread, with the records inserted since by any process.
+    Results can therefore miss records committed within the last `refresh_interval` seconds or so.
+    """
+
+    def __init__(
+        self,
+        max_project_size: int,
+        max_bytes: int,
+        dimensions: int = 768,
+        refresh_interval: float = 1.0,
+    ):
+        self.max_project_size = max_project_size
+        self.max_bytes = max_bytes
+        self.dimensions = dimensions
+        self.refresh_interval = refresh_interval
+        self._projects: collections.OrderedDict[int, ProjectVectors] = collections.OrderedDict()
+        self._oversized: set[int] = set()
+        self._warming: set[int] = set()
+        self._refreshing: set[int] = set()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="grouping-vector-index"
+        )
+
+    def __contains__(self, project_id: int) -> bool:
+        with self._lock:
+            return project_id in self._projects
+
+    def search(
+        self,
+        project_id: int,
+        embedding: np.ndarray,
+        k: int,
+        max_distance: float,
+        exclude_group_id: int,
+    ) -> list[tuple[int, str, float]] | None:
+        """
+        Returns the (group_id, message, distance) of the k nearest records of the project, or None
+        if the project is not loaded and the caller should fall back to pgvector.  A miss schedules
+        the project to be loaded, and a hit on a stale project schedules it to be refreshed.
+        """
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                self._projects.move_to_end(project_id)
+
+        if project is None:
+            self.schedule_warm(project_id)
+            return None
+
+        if time.monotonic() - project.refreshed_at >= self.refresh_interval:
+            self.schedule_refresh(project_id)
+        return project.search(embedding, k, max_distance, exclude_group_id)
+
+    def schedule_refresh(self, project_id: int):
+        with self._lock:
+            if project_id in self._refreshing:
+                return
+            self._refreshing.add(project_id)
+
+        self._executor.submit(self.refresh, project_id)
+
+    def refresh(self, project_id: int):
+        """
+        Appends the records of the project that were committed since it was last read.  Only the ids
+        near the high-water mark are listed, and embeddings are only read for the records not held
+        yet.
+        """
+        try:
+            with self._lock:
+                project = self._projects.get(project_id)
+            if project is None:
+                return
+
+            refreshed_at = time.monotonic()
+            with Session() as session:
+                recent_ids = session.scalars(
+                    select(DbGroupingRecord.id).where(
+                        DbGroupingRecord.project_id == project_id,
+                        DbGroupingRecord.group_id.isnot(None),
+                        DbGroupingRecord.id > project.max_id - REFRESH_ID_OVERLAP,
+                    )
+                ).all()
+                with project.lock:
+                    missing = [i for i in recent_ids if i not in project.record_ids]
+                rows = []
+                if missing:
+                    rows = session.execute(
+                        grouping_records_stmt(project_id).where(DbGroupingRecord.id.in_(missing))
+                    ).all()
+
+            with project.lock:
+                for row in rows:
+                    project.append(row.id, row.group_id, row.message, row.stacktrace_embedding)
+                project.refreshed_at = refreshed_at
+                oversized = len(project) > self.max_project_size
+
+            with self._lock:
+                if oversized:
+                    self._evict(project_id)
+                    self._oversized.add(project_id)
+                else:
+                    self._evict_to_capacity()
+        except Exception:
+            logger.exception(f"Failed to refresh grouping records of project {project_id}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(project_id)
+
+    def schedule_warm(self, project_id: int):
+        with self._lock:
+            if (
+                project_id in self._projects
+                or project_id in self._oversized
+                or project_id in self._warming
+            ):
+                return
+            self._warming.add(project_id)
+
+        self._executor.submit(self.warm, project_id)
+
+    def warm(self, project_id: int):
+        """
+        Loads the records of the given project into memory, unless it is too large to be held.
+        """
+        try:
+            with Session() as session:
+                size = (
+                    session.scalar(
+                        select(func.count()).select_from(
+                            grouping_records_stmt(project_id).subquery()
+                        )
+                    )
+                    or 0
+                )
+                if size > self.max_project_size:
+                    with self._lock:
+                        self._oversized.add(project_id)
+                    return
+
+                project = ProjectVectors(self.dimensions, capacity=max(16, size))
+                for row in session.execute(grouping_records_stmt(project_id)):
+                    project.append(row.id, row.group_id, row.message, row.stacktrace_embedding)
+
+            with self._lock:
+                if project_id not in self._projects:
+                    self._projects[project_id] = project
+                    self._evict_to_capacity()
+            logger.info(
+                f"Loaded {len(project)} grouping records of project {project_id} into memory"
+            )
+        except Exception:
+            logger.exception(f"Failed to load grouping records of project {project_id}")
+        finally:
+            with self._lock:
+                self._warming.discard(project_id)
+
+    def _evict(self, project_id: int):
+        self._projects.pop(project_id, None)
+
+    def _evict_to_capacity(self):
+        total = sum(project.nbytes for project in self._projects.values())
+        while total > self.max_bytes and len(self._projects) > 1:
+            _, project = self._projects.popitem(last=False)
+            total -= project.nbytes
@@ -0,0 +1,106 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+EncodeRequest = Tuple[SentenceTransformer, str, concurrent.futures.Future]
+
+# The most texts run through the model in one forward pass, unless configured otherwise.
+DEFAULT_MAX_BATCH_SIZE = 32
+
+
+def encode_batch(
+    model: SentenceTransformer, texts: List[str], batch_size: Optional[int] = None
+) -> np.ndarray:
+    """
+    Encodes the texts in a single call to the model, without tracking gradients, in forward passes
+    of at most `batch_size` texts, or a single one.
+    """
+    with torch.inference_mode():
+        return model.encode(texts, batch_size=batch_size or len(texts), convert_to_numpy=True)
+
+
+class InferenceExecutor:
+    """
+    Runs the encodes of every sentence transformer model of the process on one thread, with a fixed
+    number of torch intra-op threads, so that concurrent requests queue for the cores instead of
+    oversubscribing them.
+
+    Encodes that arrive while a batch is running are coalesced into the next one, up to
+    `max_batch_size` texts per model, so a busy worker trades per-request passes for fewer, larger
+    ones without adding latency when idle.
+    """
+
+    def __init__(self, num_threads: int, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size
+        self._queue: queue.SimpleQueue[EncodeRequest] = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def encode(self, model: SentenceTransformer, text: str) -> np.ndarray:
+        """
+        Encodes the text with the model on the inference thread, blocking until it is done.
+        """
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put((model, text, future))
+        self._ensure_started()
+        return future.result()
+
+    def encode_many(self, model: SentenceTransformer, texts: List[str]) -> np.ndarray:
+        """
+        Encodes the texts with the model on the inference thread, in batches of at most
+        max_batch_size, blocking until all are done.
+        """
+        futures: List[concurrent.futures.Future] = []
+        for text in texts:
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            self._queue.put((model, text, future))
+            futures.append(future)
+        self._ensure_started()
+        return np.stack([future.result() for future in futures])
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="inference-executor", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        torch.set_num_threads(self.num_threads)
+        logger.info(f"Inference executor started with {self.num_threads} torch threads")
+
+        while True:
+            requests = [self._queue.get()]
+            while len(requests) < self.max_batch_size:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batches: Dict[int, List[EncodeRequest]] = {}
+            for request in requests:
+                batches.setdefault(id(request[0]), []).append(request)
+            for batch in batches.values():
+                self._encode(batch)
+
+    def _encode(self, batch: List[EncodeRequest]):
+        model = batch[0][0]
+        try:
+            embeddings = encode_batch(model, [text for _, text, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
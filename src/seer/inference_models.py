@@ -2,7 +2,12 @@ import functools
 import os
 from typing import Any, Callable
 
+import torch
+
+from seer.db import GROUPING_EMBEDDING_STORAGE
 from seer.grouping.grouping import GroupingLookup
+from seer.grouping.vector_index import GroupingVectorIndex
+from seer.inference_executor import InferenceExecutor
 from seer.severity.severity_inference import SeverityInference
 
 root = os.path.abspath(os.path.join(__file__, "..", "..", ".."))
@@ -12,10 +17,43 @@ def model_path(subpath: str) -> str:
     return os.path.join(root, "models", subpath)
 
 
+@functools.cache
+def inference_executor() -> InferenceExecutor:
+    # Shared by every model of the process.  Defaults to torch's own thread count, which is the
+    # number of physical cores; set INFERENCE_NUM_THREADS to the cores available to each worker when
+    # running several per node.
+    return InferenceExecutor(
+        num_threads=int(os.environ.get("INFERENCE_NUM_THREADS", torch.get_num_threads())),
+        max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", 32)),
+    )
+
+
 @functools.cache
 def embeddings_model() -> SeverityInference:
     return SeverityInference(
-        model_path("issue_severity_v0/embeddings"), model_path("issue_severity_v0/classifier")
+        model_path("issue_severity_v0/embeddings"),
+        model_path("issue_severity_v0/classifier"),
+        executor=inference_executor(),
+    )
+
+
+def env_flag(env_var: str) -> bool:
+    return os.environ.get(env_var, "").lower() in ("true", "1", "t")
+
+
+@functools.cache
+def grouping_vector_index() -> GroupingVectorIndex | None:
+    # Every gunicorn worker holds its own copy, so the memory used per node is
+    # GROUPING_IN_MEMORY_MAX_BYTES times the number of workers.  A 768 dimension embedding takes
+    # 3 KiB, so the 64 MiB default holds ~21k records and a project at the 5k record limit takes
+    # ~15 MiB.
+    if not env_flag("GROUPING_IN_MEMORY_INDEX"):
+        return None
+
+    return GroupingVectorIndex(
+        max_project_size=int(os.environ.get("GROUPING_IN_MEMORY_MAX_PROJECT_SIZE", 5_000)),
+        max_bytes=int(os.environ.get("GROUPING_IN_MEMORY_MAX_BYTES", 64 * 1024 * 1024)),
+        refresh_interval=float(os.environ.get("GROUPING_IN_MEMORY_REFRESH_INTERVAL", 1.0)),
     )
 
 
@@ -24,6 +62,12 @@ def grouping_lookup() -> GroupingLookup:
     return GroupingLookup(
         model_path=model_path("issue_grouping_v0/embeddings"),
         data_path=model_path("issue_grouping_v0/data.pkl"),
+        vector_index=grouping_vector_index(),
+        storage_mode=GROUPING_EMBEDDING_STORAGE,  # type: ignore[arg-type]
+        executor=inference_executor(),
+        # Only enable once every existing record has been re-embedded from its canonicalized
+        # stacktrace, records embedded both ways are not comparable.
+        canonical_embeddings=env_flag("GROUPING_CANONICAL_EMBEDDINGS"),
     )
 
 
@@ -35,6 +79,6 @@ function_env_config = {
 cached: list[Callable[..., Any]] = [
     globals()[function_name]
     for function_name, env_var in function_env_config.items()
-    if os.environ.get(env_var, "").lower() in ("true", "1", "t")
+    if env_flag(env_var)
     if hasattr(globals()[function_name], "cache_info")
 ]
@@ -1,18 +1,175 @@
+import asyncio
+import contextlib
 import functools
 import inspect
-from typing import Any, Callable, List, Tuple, Type, TypeVar, get_type_hints
+import io
+import math
+import threading
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    get_type_hints,
+)
 
 import sentry_sdk
-from flask import Flask, request
+import sentry_sdk.metrics
+from aiohttp import web
+from flask import Flask, Response, request
 from pydantic import BaseModel, ValidationError
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, HTTPException, ServiceUnavailable
+
+from seer.compression import encode_response, read_body
 
 _F = TypeVar("_F", bound=Callable[..., Any])
 
-view_functions: List[Tuple[str, Callable[[], Any], Type[BaseModel], Type[BaseModel]]] = []
+# The aiohttp application the async views are registered on must be created with these, so that
+# request bodies are decoded by read_body, accepting the same encodings as under Flask, rather than
+# by aiohttp.
+ASYNC_HANDLER_ARGS = {"auto_decompress": False}
+
+view_functions: List[
+    Tuple[str, Callable[[], Any], Type[BaseModel], Type[BaseModel], Callable[..., Any]]
+] = []
+
+
+class ConcurrencyLimit:
+    """
+    Caps how many requests to a route run at once.  Requests over the cap wait up to `queue_timeout`
+    seconds for a slot and are then shed with a 503, so that callers retry elsewhere or later
+    instead of timing out behind a backlog they are only adding to.
+
+    Time the request already spent queued ahead of the process, such as in the proxy or in
+    gunicorn's accept backlog, counts against the same budget.  A sync worker with a single thread
+    only ever runs one request, so there the cap is never reached and requests are only shed once
+    they have waited `queue_timeout` seconds upstream, as reported by the `X-Request-Start` header
+    (see request_queue_time).
+
+    The number of running and waiting requests is reported as gauges, shed requests as a counter and
+    upstream queue time as a distribution, tagged with the route.
+    """
+
+    def __init__(self, route: str, max_concurrency: int, queue_timeout: float):
+        self.route = route
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphore = asyncio.Semaphore(max_concurrency)
+
+    @contextlib.contextmanager
+    def acquire(self, waited: float = 0.0):
+        timeout = self._remaining(waited)
+        self._update(queued=1)
+        try:
+            acquired = timeout > 0 and self._semaphore.acquire(timeout=timeout)
+        finally:
+            self._update(queued=-1)
+        if not acquired:
+            self.shed()
+
+        self._update(in_flight=1)
+        try:
+            yield
+        finally:
+            self._update(in_flight=-1)
+            self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def acquire_async(self, waited: float = 0.0):
+        timeout = self._remaining(waited)
+        self._update(queued=1)
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            if self._async_semaphore.locked():
+                await asyncio.wait_for(self._async_semaphore.acquire(), timeout)
+            else:
+                await self._async_semaphore.acquire()
+        except asyncio.TimeoutError:
+            self.shed()
+        finally:
+            self._update(queued=-1)
+
+        self._update(in_flight=1)
+        try:
+            yield
+        finally:
+            self._update(in_flight=-1)
+            self._async_semaphore.release()
+
+    def _remaining(self, waited: float) -> float:
+        if waited:
+            sentry_sdk.metrics.distribution(
+                "seer.json_api.queue_time", waited, unit="second", tags={"route": self.route}
+            )
+        return self.queue_timeout - waited
+
+    def shed(self):
+        sentry_sdk.metrics.incr("seer.json_api.shed", tags={"route": self.route})
+        raise ServiceUnavailable(
+            f"{self.route} is over capacity", retry_after=max(1, math.ceil(self.queue_timeout))
+        )
+
+    def _update(self, in_flight: int = 0, queued: int = 0):
+        with self._lock:
+            self.in_flight += in_flight
+            self.queued += queued
+            in_flight, queued = self.in_flight, self.queued
+        tags = {"route": self.route}
+        sentry_sdk.metrics.gauge("seer.json_api.in_flight", in_flight, tags=tags)
+        sentry_sdk.metrics.gauge("seer.json_api.queued", queued, tags=tags)
+
+
+concurrency_limits: Dict[str, ConcurrencyLimit] = {}
+
 
+def request_queue_time(header: Optional[str], now: Optional[float] = None) -> float:
+    """
+    Seconds a request spent queued before reaching the process, from the `X-Request-Start` header a
+    proxy in front of it stamps when the request arrives, as `t=<timestamp>` or a bare timestamp in
+    seconds, milliseconds or microseconds since the epoch.  0 when the header is missing or
+    unreadable, or the clocks disagree.
+    """
+    if not header:
+        return 0.0
+    value = header.strip().removeprefix("t=")
+    try:
+        start = float(value)
+    except ValueError:
+        return 0.0
+    if not math.isfinite(start) or start <= 0:
+        return 0.0
+    # Seconds since the epoch stay below 1e11 for a few thousand years, so anything larger is in
+    # finer units.
+    while start >= 1e11:
+        start /= 1000
+    return max(0.0, (time.time() if now is None else now) - start)
+
+
+def json_api(
+    url_rule: str, max_concurrency: Optional[int] = None, queue_timeout: float = 1.0
+) -> Callable[[_F], _F]:
+    """
+    Registers the implementation as a JSON endpoint, served by the Flask app through
+    register_json_api_views and by the async server through register_async_json_api_views.
+    Implementations may be `async def`, in which case they should not block, and run on the event
+    loop of the async server, or on a background event loop under Flask.
+
+    With `max_concurrency`, at most that many requests to the endpoint run at once per process, and
+    requests that cannot start within `queue_timeout` seconds, including the time they were queued
+    upstream, are answered with a 503 and a Retry-After header.
+    """
 
-def json_api(url_rule: str) -> Callable[[_F], _F]:
     def decorator(implementation: _F) -> _F:
         spec = inspect.getfullargspec(implementation)
         annotations = get_type_hints(implementation)
@@ -27,28 +184,132 @@ def json_api(url_rule: str) -> Callable[[_F], _F]:
                 f"json_api implementations must have one non keyword, argument, annotated with a BaseModel and a BaseModel return value"
             )
 
-        def wrapper() -> Any:
-            data = request.get_json()
-            if not isinstance(data, dict):
-                sentry_sdk.capture_message(f"Data is not an object: {type(data)}")
-                raise BadRequest("Data is not an object")
+        limit = None
+        if max_concurrency is not None:
+            limit = concurrency_limits[url_rule] = ConcurrencyLimit(
+                url_rule, max_concurrency, queue_timeout
+            )
 
-            try:
-                result: BaseModel = implementation(request_annotation.model_validate(data))
-            except ValidationError as e:
-                sentry_sdk.capture_exception(e)
-                raise BadRequest(str(e))
+        def wrapper() -> Any:
+            # Admitted before the body is read, so that shed requests cost no more than their
+            # headers.
+            waited = request_queue_time(request.headers.get("X-Request-Start"))
+            with limit.acquire(waited) if limit else contextlib.nullcontext():
+                # Validated straight from the body and serialized straight to it, without building
+                # intermediate dicts or going through the stdlib json module.
+                content_encoding = request.headers.get("Content-Encoding")
+                if content_encoding:
+                    body = read_body(request.stream, content_encoding)
+                else:
+                    body = request.get_data()
+                try:
+                    data = request_annotation.model_validate_json(body)
+                    result: BaseModel = run_implementation(implementation, data)
+                except ValidationError as e:
+                    sentry_sdk.capture_exception(e)
+                    raise BadRequest(str(e))
 
-            return result.model_dump()
+            body, content_encoding = encode_response(
+                result.model_dump_json().encode(), request.headers.get("Accept-Encoding")
+            )
+            response = Response(body, mimetype="application/json")
+            if content_encoding:
+                response.headers["Content-Encoding"] = content_encoding
+            response.vary.add("Accept-Encoding")
+            return response
 
         functools.update_wrapper(wrapper, implementation)
-        view_functions.append((url_rule, wrapper, request_annotation, response_annotation))
+        view_functions.append(
+            (url_rule, wrapper, request_annotation, response_annotation, implementation)
+        )
 
         return implementation
 
     return decorator
 
 
+def run_implementation(implementation: Callable[..., Any], data: BaseModel) -> BaseModel:
+    if inspect.iscoroutinefunction(implementation):
+        return asyncio.run_coroutine_threadsafe(
+            implementation(data), background_event_loop()
+        ).result()
+    return implementation(data)
+
+
+_background_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_event_loop_lock = threading.Lock()
+
+
+def background_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    A single event loop per process, running on its own thread, that async implementations are run
+    on when served by Flask.  It is kept for the life of the process so that AsyncSession
+    connections, which belong to the loop they were opened on, can be pooled across requests.
+    """
+    global _background_event_loop
+    with _background_event_loop_lock:
+        if _background_event_loop is None:
+            _background_event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_event_loop.run_forever, name="json-api-event-loop", daemon=True
+            ).start()
+        return _background_event_loop
+
+
 def register_json_api_views(app: Flask) -> None:
-    for url_rule, wrapper, _, _ in view_functions:
+    for url_rule, wrapper, _, _, _ in view_functions:
         app.add_url_rule(url_rule, view_func=wrapper, methods=["POST"])
+
+
+def register_async_json_api_views(app: web.Application) -> None:
+    for url_rule, _, request_annotation, _, implementation in view_functions:
+        app.router.add_post(
+            url_rule,
+            async_view(implementation, request_annotation, concurrency_limits.get(url_rule)),
+        )
+
+
+def async_view(
+    implementation: Callable[..., Any],
+    request_annotation: Type[BaseModel],
+    limit: Optional[ConcurrencyLimit] = None,
+) -> Callable[[web.Request], Awaitable[web.Response]]:
+    """
+    Wraps a json_api implementation as an aiohttp handler.  Synchronous implementations run on the
+    loop's default executor, so they do not hold up the requests that are waiting on I/O.
+    """
+
+    async def handler(http_request: web.Request) -> web.Response:
+        try:
+            waited = request_queue_time(http_request.headers.get("X-Request-Start"))
+            async with limit.acquire_async(waited) if limit else contextlib.nullcontext():
+                body = read_body(
+                    io.BytesIO(await http_request.read()),
+                    http_request.headers.get("Content-Encoding"),
+                )
+                parsed = request_annotation.model_validate_json(body)
+                if inspect.iscoroutinefunction(implementation):
+                    result: BaseModel = await implementation(parsed)
+                else:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(None, implementation, parsed)
+        except ValidationError as e:
+            sentry_sdk.capture_exception(e)
+            raise web.HTTPBadRequest(text=str(e))
+        except HTTPException as e:
+            return web.Response(
+                status=e.code or 500,
+                text=e.description,
+                headers={k: v for k, v in e.get_headers() if k != "Content-Type"},
+            )
+
+        body, response_encoding = encode_response(
+            result.model_dump_json().encode(), http_request.headers.get("Accept-Encoding")
+        )
+        response = web.Response(body=body, content_type="application/json")
+        if response_encoding:
+            response.headers["Content-Encoding"] = response_encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    return handler
@@ -0,0 +1,102 @@
+"""
+Compares json_api's request decoding and response encoding against the previous path, which went
+through the stdlib json module and an intermediate dict tree in both directions.
+
+    python src/seer/json_api_benchmark.py --transactions 500 --buckets 336
+"""
+import argparse
+import json
+import random
+import timeit
+from typing import Callable
+
+from seer.trend_detection.trend_detector import (
+    BreakpointEntry,
+    BreakpointRequest,
+    BreakpointResponse,
+)
+
+
+def breakpoint_request_body(transactions: int, buckets: int) -> bytes:
+    rng = random.Random(0)
+    return json.dumps(
+        {
+            "data": {
+                f"1,/api/0/transaction/{i}/": {
+                    "data": [
+                        [1_700_000_000 + 3600 * t, [{"count": rng.random() * 100}]]
+                        for t in range(buckets)
+                    ],
+                    "request_start": 1_700_000_000,
+                    "request_end": 1_700_000_000 + 3600 * buckets,
+                    "data_start": 1_700_000_000,
+                    "data_end": 1_700_000_000 + 3600 * buckets,
+                }
+                for i in range(transactions)
+            },
+            "sort": "-trend_percentage()",
+        }
+    ).encode()
+
+
+def breakpoint_response(entries: int) -> BreakpointResponse:
+    return BreakpointResponse(
+        data=[
+            BreakpointEntry(
+                project="1",
+                transaction=f"/api/0/transaction/{i}/",
+                aggregate_range_1=1.5,
+                aggregate_range_2=3.0,
+                unweighted_t_value=-4.2,
+                unweighted_p_value=0.001,
+                trend_percentage=2.0,
+                absolute_percentage_change=2.0,
+                trend_difference=1.5,
+                breakpoint=1_700_000_000,
+                request_start=1_700_000_000,
+                request_end=1_700_100_000,
+                data_start=1_700_000_000,
+                data_end=1_700_100_000,
+                change="regression",
+            )
+            for i in range(entries)
+        ]
+    )
+
+
+def report(name: str, before: Callable[[], object], after: Callable[[], object], number: int):
+    before_seconds = min(timeit.repeat(before, number=number, repeat=5)) / number
+    after_seconds = min(timeit.repeat(after, number=number, repeat=5)) / number
+    print(
+        f"{name:>8}: {before_seconds * 1000:8.2f}ms -> {after_seconds * 1000:8.2f}ms "
+        f"({before_seconds / after_seconds:.1f}x)"
+    )
+
+
+def run(transactions: int, buckets: int, number: int):
+    body = breakpoint_request_body(transactions, buckets)
+    response = breakpoint_response(transactions)
+    print(f"request body: {len(body) / 1024 / 1024:.1f} MiB")
+
+    report(
+        "decode",
+        lambda: BreakpointRequest.model_validate(json.loads(body)),
+        lambda: BreakpointRequest.model_validate_json(body),
+        number,
+    )
+    report(
+        "encode",
+        lambda: json.dumps(response.model_dump()),
+        lambda: response.model_dump_json(),
+        number,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=500)
+    parser.add_argument("--buckets", type=int, default=336)
+    parser.add_argument("--number", type=int, default=3)
+    args = parser.parse_args()
+
+    run(args.transactions, args.buckets, args.number)
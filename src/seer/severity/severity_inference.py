@@ -7,6 +7,8 @@ from joblib import load
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
 
+from seer.inference_executor import InferenceExecutor, encode_batch
+
 
 class SeverityRequest(BaseModel):
     message: str = ""
@@ -21,8 +23,11 @@ class SeverityResponse(BaseModel):
 
 
 class SeverityInference:
-    def __init__(self, embeddings_path, classifier_path):
+    def __init__(
+        self, embeddings_path, classifier_path, executor: Optional[InferenceExecutor] = None
+    ):
         """Initialize the inference class with pre-trained models and tokenizer."""
+        self.executor = executor
         self.embeddings_model = SentenceTransformer(
             embeddings_path,
             device=torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu"),
@@ -31,7 +36,9 @@ class SeverityInference:
 
     def get_embeddings(self, text) -> np.ndarray:
         """Generate embeddings for the given text using the pre-trained model."""
-        return self.embeddings_model.encode(text, convert_to_numpy=True)
+        if self.executor is not None:
+            return self.executor.encode(self.embeddings_model, text)
+        return encode_batch(self.embeddings_model, [text])[0]
 
     def severity_score(self, data: SeverityRequest) -> SeverityResponse:
         """Predict the severity score for the given text using the pre-trained classifier."""
@@ -1,8 +1,8 @@
 import abc
 import asyncio
+import functools
 import logging
 from concurrent.futures import ThreadPoolExecutor
-from queue import Empty, Full, Queue
 from typing import Any, Callable
 
 import celery.result
@@ -22,57 +22,62 @@ class AsyncTaskFactory(abc.ABC):
         pass
 
     async def async_celery_job(self, cb: Callable[[], celery.result.AsyncResult]):
+        """
+        Starts the celery job returned by `cb` and yields the result of each of its PROGRESS
+        updates, in order, before raising its failure, if any.  Raising into the generator revokes
+        the job.
+        """
         logger.info("Starting async celery job")
         loop = asyncio.get_running_loop()
-        q: Queue = Queue(1)
-
-        with ThreadPoolExecutor() as pool:
-            ar = await loop.run_in_executor(pool, cb)
-
-            def run():
-                def on_message(raw: Any):
-                    # Keep trying to put the item into the queue by removing existing item until we get in.
-                    logger.info("Received response from celery job")
-                    while True:
-                        try:
-                            q.put_nowait(raw)
-                            return
-                        except Full:
-                            try:
-                                q.get_nowait()
-                            except Empty:
-                                pass
-
-                ar.get(on_message=on_message, propagate=True)
-
-            complete = loop.run_in_executor(pool, run)
-
-            try:
-                while not complete.done():
-                    get = loop.run_in_executor(pool, q.get)
-                    await asyncio.wait([get, complete], return_when=asyncio.FIRST_COMPLETED)
-                    if get.done():
-                        v = await get
-                        if v:
-                            if v["status"] == "PROGRESS":
-                                try:
-                                    yield v["result"]
-                                except Exception as e:
-                                    if not complete.done():
-                                        logger.warning("SIGUSR1 on job, generator failed")
-                                        await loop.run_in_executor(
-                                            pool,
-                                            lambda: ar.revoke(
-                                                terminate=True, signal="SIGUSR1", wait=False
-                                            ),
-                                        )
-                                    raise e
-            finally:
-                logger.info("async celery job completing")
-                loop.run_in_executor(pool, lambda: q.put_nowait(None))
+        executor = celery_result_executor()
+        messages: asyncio.Queue[Any] = asyncio.Queue()
+
+        ar = await loop.run_in_executor(executor, cb)
+
+        def on_message(raw: Any):
+            logger.info("Received response from celery job")
+            loop.call_soon_threadsafe(messages.put_nowait, raw)
+
+        # on_message hands every message to the loop before get returns, so by the time complete is
+        # done, every message the job sent is already in the queue.
+        complete = loop.run_in_executor(
+            executor, lambda: ar.get(on_message=on_message, propagate=True)
+        )
+
+        try:
+            while not (complete.done() and messages.empty()):
+                get = asyncio.ensure_future(messages.get())
+                await asyncio.wait([get, complete], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    continue
+
+                v = get.result()
+                if v and v["status"] == "PROGRESS":
+                    try:
+                        yield v["result"]
+                    except Exception as e:
+                        if not complete.done():
+                            logger.warning("SIGUSR1 on job, generator failed")
+                            await loop.run_in_executor(
+                                executor,
+                                lambda: ar.revoke(terminate=True, signal="SIGUSR1", wait=False),
+                            )
+                        raise e
+        finally:
+            logger.info("async celery job completing")
         await complete
 
 
+@functools.cache
+def celery_result_executor() -> ThreadPoolExecutor:
+    """
+    Shared by the async_celery_jobs of the process, to start jobs and wait on their results.  Celery
+    has no asyncio client, so each running job holds one of its threads while it waits.
+    """
+    return ThreadPoolExecutor(max_workers=32, thread_name_prefix="celery-result")
+
+
 _async_task_factories: list[Callable[[], AsyncTaskFactory]] = []
 
 
@@ -1,21 +1,25 @@
 import asyncio
+import collections
 import contextlib
 import dataclasses
 import datetime
 import hashlib
 import logging
-import threading
+import os
 from asyncio import Future, Task
 from queue import Queue
-from typing import Any, Callable, Coroutine, Protocol, TypeVar
+from typing import Any, AsyncIterator, Callable, Coroutine, Protocol, TypeVar
 
+import psycopg
+import sentry_sdk
+import sentry_sdk.metrics
 import sqlalchemy
 from dateutil.relativedelta import relativedelta
 from sentry_sdk.integrations.asyncio import AsyncioIntegration
-from sqlalchemy import func, select, text
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
 
-from seer.db import AsyncSession, ProcessRequest
+from seer.db import BULK_LANE, PROCESS_REQUEST_CHANNEL, AsyncSession, ProcessRequest
 from seer.task_factory import AsyncTaskFactory, _async_task_factories
 
 _A = TypeVar("_A")
@@ -30,6 +34,15 @@ class QConsumer(Protocol):
         ...
 
 
+class KillEvent(Protocol):
+    """
+    A threading.Event, or a multiprocessing Event shared with a supervisor, see async_supervisor.py.
+    """
+
+    def wait(self, timeout: float | None = None) -> bool:
+        ...
+
+
 @dataclasses.dataclass(frozen=True, order=True)
 class Period:
     period_start: datetime.date
@@ -61,13 +74,77 @@ class Period:
 class AsyncApp:
     end_event: asyncio.Event = dataclasses.field(default_factory=lambda: asyncio.Event())
     num_consumers: int = 10
-    queue: asyncio.Queue = dataclasses.field(default_factory=lambda: asyncio.Queue())
+    # Work acquired ahead of a consumer becoming free, and the most acquired in one round trip.
+    # Work is only leased once a consumer can pick it up soon, so that its lease does not run out
+    # while it waits in the queue, and so that other workers can take what this one does not have
+    # the consumers for.
+    prefetch: int = 2
+    max_batch_size: int = 10
+    # Defaults to a queue bounded to num_consumers + prefetch
+    queue: asyncio.Queue | None = None
     task_factories: list[Callable[[], AsyncTaskFactory]] = dataclasses.field(
         default_factory=lambda: _async_task_factories,
     )
     completed_queue: Queue | None = None
     consumer_sleep: int = 5
     fail_fast: bool = False
+    # Set when new work is scheduled, see listen_for_work, or when a consumer becomes idle
+    wakeup: asyncio.Event = dataclasses.field(default_factory=lambda: asyncio.Event())
+    idle_consumers: int = 0
+    # The most items of each lane that are queued or running at once.  Lanes without a cap share the
+    # consumers left over, so latency sensitive work is never stuck behind a flood of bulk work.
+    lane_concurrency: dict[str, int] = dataclasses.field(default_factory=lambda: {BULK_LANE: 2})
+    lane_counts: collections.Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    # Items being invoked keep their lease by having it renewed every heartbeat_interval seconds.
+    # Completed items are deleted in batches every completion_interval seconds.
+    heartbeat_interval: float = 30
+    lease_duration: datetime.timedelta = datetime.timedelta(minutes=2)
+    completion_interval: float = 1
+    running: dict[int, ProcessRequest] = dataclasses.field(default_factory=dict)
+    # How often the depth and age of the queue are reported
+    metrics_interval: float = 10
+    completed: list[ProcessRequest] = dataclasses.field(default_factory=list)
+
+    def __post_init__(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.num_consumers + self.prefetch)
+
+    @property
+    def work_queue(self) -> asyncio.Queue:
+        assert self.queue is not None, "set in __post_init__"
+        return self.queue
+
+    @property
+    def acquire_size(self) -> int:
+        """
+        How much work to acquire now: enough for every idle consumer plus the prefetch, less what is
+        queued already.
+        """
+        return max(
+            0,
+            min(self.max_batch_size, self.idle_consumers + self.prefetch - self.work_queue.qsize()),
+        )
+
+    def acquire_work(
+        self, session: sqlalchemy.orm.Session, batch_size: int, lane_room: dict[str, int]
+    ) -> list[ProcessRequest]:
+        """
+        Acquires up to `batch_size` items: from each capped lane no more than it has room for, and
+        the rest from the lanes without a cap.
+        """
+        now = datetime.datetime.utcnow()
+        items: list[ProcessRequest] = []
+        for lane, room in lane_room.items():
+            room = min(room, batch_size - len(items))
+            if room > 0:
+                items.extend(ProcessRequest.acquire_work(room, now, session=session, lanes=[lane]))
+        if len(items) < batch_size:
+            items.extend(
+                ProcessRequest.acquire_work(
+                    batch_size - len(items), now, session=session, exclude_lanes=list(lane_room)
+                )
+            )
+        return items
 
     async def run_or_end(self, c: Future[_A] | Coroutine[Any, Any, _A]) -> tuple[_A] | None:
         end_task = asyncio.create_task(self.end_event.wait())
@@ -90,66 +167,220 @@ class AsyncApp:
 
     async def select_from_db(self) -> None:
         while not self.end_event.is_set():
+            # Cleared before acquiring, so that work scheduled after the acquisition started is not
+            # missed.
+            self.wakeup.clear()
+            batch_size = self.acquire_size
+            if not batch_size:
+                await self.run_or_end(self.wait_for_work())
+                continue
+
+            lane_room = {
+                lane: limit - self.lane_counts[lane]
+                for lane, limit in self.lane_concurrency.items()
+            }
             async with AsyncSession() as session:
                 logger.info("Checking for process requests")
                 result = await self.run_or_end(
                     session.run_sync(
-                        lambda session: ProcessRequest.acquire_work(
-                            10, datetime.datetime.utcnow(), session=session
-                        )
+                        lambda session: self.acquire_work(session, batch_size, lane_room)
                     )
                 )
             if result is not None and result[0]:
+                for item in result[0]:
+                    self.lane_counts[item.lane] += 1
                 for item in result[0]:
                     logger.info(f"Picked up process request, running")
-                    await self.run_or_end(self.queue.put(item))
+                    await self.run_or_end(self.work_queue.put(item))
                     logger.info(f"Process request completed successfully")
                     if self.end_event.is_set():
                         break
             else:
                 logger.info("Sleeping")
-                await self.run_or_end(asyncio.sleep(self.consumer_sleep))
+                await self.run_or_end(self.wait_for_work())
+
+    async def wait_for_work(self):
+        """
+        Waits until new work is scheduled or a consumer frees up, or for consumer_sleep seconds, to
+        pick up work that was scheduled for later, or whose notification was missed.
+        """
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.wakeup.wait(), self.consumer_sleep)
+
+    async def listen_for_work(self):
+        """
+        Listens on PROCESS_REQUEST_CHANNEL on a dedicated connection, waking up the producer
+        whenever work is scheduled.  The producer keeps polling while the connection is down.
+        """
+        engine = AsyncSession.kw["bind"]
+        conninfo = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+        while not self.end_event.is_set():
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo, autocommit=True
+                ) as connection:
+                    await connection.execute(f"LISTEN {PROCESS_REQUEST_CHANNEL}")
+                    logger.info("Listening for process requests")
+                    async for _ in connection.notifies():
+                        self.wakeup.set()
+            except psycopg.Error:
+                logger.exception("Lost connection listening for process requests, reconnecting")
+            await asyncio.sleep(self.consumer_sleep)
 
     async def producer_loop(self):
-        await asyncio.gather(self.select_from_db())
+        # A task group rather than gather, so that when one of these dies the others are cancelled
+        # with it, rather than left running alongside the ones run() restarts.
+        async with asyncio.TaskGroup() as group:
+            group.create_task(self.select_from_db())
+            group.create_task(self.run_or_end(self.listen_for_work()))
+            group.create_task(self.heartbeat_loop())
+            group.create_task(self.completion_loop())
+            group.create_task(self.metrics_loop())
+
+    async def metrics_loop(self):
+        while not self.end_event.is_set():
+            await self.run_or_end(asyncio.sleep(self.metrics_interval))
+            try:
+                await self.report_queue_metrics()
+            except Exception:
+                logger.exception("Failed to report process request queue metrics")
+
+    async def report_queue_metrics(self):
+        """
+        Reports the work that is ready, by name prefix, and how long the oldest of it has been
+        waiting.
+        """
+        now = datetime.datetime.utcnow()
+        async with AsyncSession() as session:
+            ready = (await session.execute(ProcessRequest.ready_by_prefix_stmt(now))).all()
+            oldest = await session.run_sync(ProcessRequest.peek_next_scheduled)
+
+        for prefix, count in ready:
+            sentry_sdk.metrics.gauge(
+                "seer.process_request.ready", count, tags={"prefix": prefix or "none"}
+            )
+        sentry_sdk.metrics.gauge(
+            "seer.process_request.oldest_ready_age",
+            max(0.0, (now - oldest).total_seconds()) if oldest else 0.0,
+            unit="second",
+        )
+
+    async def heartbeat_loop(self):
+        while not self.end_event.is_set():
+            await self.run_or_end(asyncio.sleep(self.heartbeat_interval))
+            try:
+                await self.renew_leases()
+            except Exception:
+                logger.exception("Failed to renew process request leases")
+
+    async def renew_leases(self):
+        running = list(self.running.values())
+        if running:
+            async with AsyncSession() as session:
+                await session.execute(
+                    ProcessRequest.renew_leases_stmt(
+                        running, datetime.datetime.utcnow(), self.lease_duration
+                    )
+                )
+                await session.commit()
+
+    async def completion_loop(self):
+        while not self.end_event.is_set():
+            await self.run_or_end(asyncio.sleep(self.completion_interval))
+            try:
+                await self.flush_completed()
+            except Exception:
+                logger.exception("Failed to mark process requests completed, retrying")
+
+    async def flush_completed(self):
+        completed, self.completed = self.completed, []
+        if not completed:
+            return
+
+        try:
+            if to_delete := [item for item in completed if item.id]:
+                async with AsyncSession() as session:
+                    logger.info(f"Marking {len(to_delete)} process requests completed.")
+                    await session.execute(ProcessRequest.mark_completed_batch_stmt(to_delete))
+                    await session.commit()
+        except Exception:
+            self.completed.extend(completed)
+            raise
+
+        if self.completed_queue:
+            q = self.completed_queue
+
+            def hand_off():
+                for item in completed:
+                    q.put(item)
+
+            await asyncio.get_running_loop().run_in_executor(None, hand_off)
 
     async def invoke_task(self, task: AsyncTaskFactory, process_request: ProcessRequest):
-        async with AsyncSession() as session, acquire_x_lock(
-            process_request.name, session
-        ) as acquired:
-            if acquired:
-                await session.execute(text("SET idle_in_transaction_session_timeout = '1h'"))
+        async with hold_name_lock(process_request.name) as acquired:
+            if not acquired:
+                # Left to be retried once its lease runs out, by which time the other worker may be
+                # done.
+                logger.info(f"{process_request.name} is running elsewhere, skipping")
+                return False
+            return await self.invoke_locked_task(task, process_request)
+
+    async def invoke_locked_task(self, task: AsyncTaskFactory, process_request: ProcessRequest):
+        tags = {"factory": type(task).__name__}
+        sentry_sdk.metrics.distribution(
+            "seer.process_request.start_latency",
+            (datetime.datetime.utcnow() - process_request.created_at).total_seconds(),
+            unit="second",
+            tags=tags,
+        )
+        sentry_sdk.metrics.distribution(
+            "seer.process_request.retries", process_request.retries(), tags=tags
+        )
+
+        # Acquisition already leased the item, the heartbeat loop renews that lease until the
+        # invocation is done.
+        self.running[process_request.id] = process_request
+        status = "failure"
+        try:
+            with sentry_sdk.metrics.timing("seer.process_request.duration", tags=tags):
                 await task.invoke(process_request)
-            return acquired
+            status = "success"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self.running.pop(process_request.id, None)
+            sentry_sdk.metrics.incr("seer.process_request.invoked", tags={**tags, "status": status})
+        return True
 
     async def consumer_loop(self):
         while not self.end_event.is_set():
             logger.info("Running consumer loop")
-            result = await self.run_or_end(self.queue.get())
+            self.idle_consumers += 1
+            self.wakeup.set()
+            try:
+                result = await self.run_or_end(self.work_queue.get())
+            finally:
+                self.idle_consumers -= 1
             if result is None:
                 continue
 
             item: ProcessRequest = result[0]
             logger.info(f"Consumer loop working on {item.name}.")
-            for factory in self.task_factories:
-                task = factory()
-                accept = task.matches(item)
-                if accept:
-                    result = await self.run_or_end(self.invoke_task(task, item))
-
-                    if result:
-                        if item.id:
-                            async with AsyncSession() as session:
-                                logger.info("Marking process request completed.")
-                                await session.execute(item.mark_completed_stmt())
-                                await session.commit()
-                        if self.completed_queue:
-                            q = self.completed_queue
-                            await self.run_or_end(
-                                asyncio.get_event_loop().run_in_executor(None, lambda: q.put(item))
-                            )
-
-    async def kill_event_task(self, kill_event: threading.Event | None):
+            try:
+                for factory in self.task_factories:
+                    task = factory()
+                    accept = task.matches(item)
+                    if accept:
+                        result = await self.run_or_end(self.invoke_task(task, item))
+
+                        if result:
+                            self.completed.append(item)
+            finally:
+                self.lane_counts[item.lane] -= 1
+
+    async def kill_event_task(self, kill_event: KillEvent | None):
         if kill_event is None:
             return
 
@@ -161,9 +392,10 @@ class AsyncApp:
                 self.end_event.set()
                 break
 
-    async def run(self, kill_event: threading.Event | None = None):
+    async def run(self, kill_event: KillEvent | None = None):
         # Force loading of tasks
         from seer.automation.autofix import tasks  # noqa
+        from seer.grouping import backfill  # noqa
 
         kill_task = asyncio.create_task(self.kill_event_task(kill_event))
         producer_task = asyncio.create_task(self.producer_loop())
@@ -193,21 +425,37 @@ class AsyncApp:
         all_tasks = [producer_task, *consumer_tasks, kill_task]
         async with asyncio.timeout(10):
             await asyncio.gather(*all_tasks)
+            await self.flush_completed()
 
 
-@contextlib.asynccontextmanager
-async def acquire_x_lock(name: str, session: sqlalchemy.ext.asyncio.AsyncSession):
+def name_lock_key(name: str) -> int:
     m = hashlib.sha256()
     m.update(name.encode("utf8"))
-    key = int.from_bytes(m.digest()[:8], byteorder="big", signed=True) & 0xFFFFFFFF
+    return int.from_bytes(m.digest()[:8], byteorder="big", signed=True) & 0xFFFFFFFF
+
 
-    logger.info("Acquiring exclusive lock for %s", key)
-    rows = await session.execute(select(func.pg_try_advisory_xact_lock(key)))
-    acquired = next(rows)[0]
-    yield acquired
+@contextlib.asynccontextmanager
+async def hold_name_lock(name: str) -> AsyncIterator[bool]:
+    """
+    Holds a session level advisory lock on `name` for the duration of the block, so that work of one
+    name never runs on two workers at once.  The lock is taken on a connection of its own in
+    autocommit mode, so that no transaction is left open while the work runs.  Yields whether the
+    lock was acquired, which it is not while another worker holds it.
+    """
+    key = name_lock_key(name)
+    engine: AsyncEngine = AsyncSession.kw["bind"]
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        logger.info("Acquiring exclusive lock for %s", key)
+        acquired = bool(await connection.scalar(select(func.pg_try_advisory_lock(key))))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await connection.scalar(select(func.pg_advisory_unlock(key)))
 
 
-async def async_main():
+async def async_main(kill_event: KillEvent | None = None):
     from seer.bootup import bootup
 
     bootup(
@@ -218,8 +466,17 @@ async def async_main():
         eager_load_inference_models=False,
     )
     app = AsyncApp()
-    await app.run()
+    await app.run(kill_event)
 
 
 if __name__ == "__main__":
-    asyncio.run(async_main())
+    num_processes = int(os.environ.get("ASYNC_WORKER_PROCESSES", 1))
+    if num_processes > 1:
+        from seer.async_supervisor import supervise
+
+        supervise(
+            num_processes,
+            health_timeout=float(os.environ.get("ASYNC_WORKER_HEALTH_TIMEOUT", 300)),
+        )
+    else:
+        asyncio.run(async_main())
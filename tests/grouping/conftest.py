@@ -0,0 +1,63 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from seer.db import DbGroupingRecord, Session
+from seer.grouping.grouping import GroupingLookup, GroupingRequest, SimilarityResponse
+
+DIMENSIONS = 768
+
+
+def random_embeddings(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+
+def near(embedding: np.ndarray, seed: int = 1, scale: float = 0.05) -> np.ndarray:
+    noise = np.random.default_rng(seed).normal(scale=scale, size=DIMENSIONS)
+    return (embedding + noise).astype(np.float32)
+
+
+def save_records(project_id: int, embeddings: np.ndarray, first_group_id: int = 1):
+    with Session() as session:
+        for i, embedding in enumerate(embeddings):
+            session.add(
+                DbGroupingRecord(
+                    group_id=first_group_id + i,
+                    project_id=project_id,
+                    message=f"message {first_group_id + i}",
+                    stacktrace_embedding=embedding,
+                )
+            )
+        session.commit()
+
+
+def lookup_neighbors(
+    lookup: GroupingLookup,
+    project_id: int,
+    group_id: int,
+    embedding: np.ndarray,
+    k: int = 5,
+    **kwargs,
+) -> SimilarityResponse:
+    lookup.model.encode.return_value = embedding[np.newaxis, :]
+    return lookup.get_nearest_neighbors(
+        GroupingRequest(
+            group_id=group_id,
+            project_id=project_id,
+            # Distinct per group unless given, so lookups are not answered as exact duplicates
+            stacktrace=kwargs.pop("stacktrace", f"stacktrace {group_id}"),
+            message=kwargs.pop("message", "message"),
+            k=k,
+            threshold=kwargs.pop("threshold", 0.01),
+            **kwargs,
+        )
+    )
+
+
+@pytest.fixture
+def grouping_lookup():
+    with mock.patch("seer.grouping.grouping.SentenceTransformer"), mock.patch.object(
+        GroupingLookup, "initialize_db"
+    ):
+        yield GroupingLookup(model_path="", data_path="")
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from sqlalchemy import select
+
+from seer.db import DbGroupingRecord, ProcessRequest, Session
+from seer.grouping.backfill import GroupingBackfillRequest, GroupingBackfillTask, schedule_backfill
+from seer.grouping.grouping import GroupingBackfillRecord, GroupingLookup, hash_stacktrace
+from seer.grouping.stacktrace import canonicalize_stacktrace
+from seer.inference_executor import DEFAULT_MAX_BATCH_SIZE
+from tests.grouping.conftest import random_embeddings, save_records
+
+
+def backfill_records(project_id: int, group_ids: range) -> list[GroupingBackfillRecord]:
+    return [
+        GroupingBackfillRecord(
+            group_id=group_id,
+            project_id=project_id,
+            stacktrace=f"File app.py, line {group_id}\nValueError {group_id}",
+            message=f"message {group_id}",
+        )
+        for group_id in group_ids
+    ]
+
+
+def test_backfill_embeds_in_batches_and_skips_existing_groups(grouping_lookup: GroupingLookup):
+    grouping_lookup.model.encode.side_effect = lambda texts, **kwargs: random_embeddings(len(texts))
+    save_records(1, random_embeddings(2), first_group_id=1)
+
+    with mock.patch("seer.grouping.grouping.BACKFILL_BATCH_SIZE", 3):
+        inserted = grouping_lookup.backfill(backfill_records(1, range(1, 9)))
+
+    assert inserted == 6
+    assert [len(c.args[0]) for c in grouping_lookup.model.encode.call_args_list] == [1, 3, 2]
+    assert {c.kwargs["batch_size"] for c in grouping_lookup.model.encode.call_args_list} == {
+        DEFAULT_MAX_BATCH_SIZE
+    }
+    with Session() as session:
+        records = session.scalars(select(DbGroupingRecord).order_by(DbGroupingRecord.group_id))
+        assert [r.group_id for r in records] == list(range(1, 9))
+
+    grouping_lookup.model.encode.reset_mock()
+    assert grouping_lookup.backfill(backfill_records(1, range(1, 9))) == 0
+    grouping_lookup.model.encode.assert_not_called()
+
+
+def test_backfilled_records_are_hashed_like_lookups(grouping_lookup: GroupingLookup):
+    grouping_lookup.model.encode.side_effect = lambda texts, **kwargs: random_embeddings(len(texts))
+    (record,) = backfill_records(1, range(5, 6))
+    grouping_lookup.backfill([record])
+
+    with Session() as session:
+        backfilled = session.scalar(select(DbGroupingRecord))
+    assert backfilled.stacktrace_hash == hash_stacktrace(canonicalize_stacktrace(record.stacktrace))
+
+
+def test_backfill_pages_are_scheduled_once():
+    request = GroupingBackfillRequest(
+        backfill_id="backfill", page=3, records=backfill_records(1, range(1, 3))
+    )
+    with Session() as session:
+        schedule_backfill(session, request)
+        schedule_backfill(session, request)
+        session.commit()
+        (process_request,) = session.scalars(select(ProcessRequest)).all()
+
+    assert GroupingBackfillTask().matches(process_request)
+    assert GroupingBackfillRequest.model_validate(process_request.payload) == request
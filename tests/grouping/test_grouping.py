@@ -0,0 +1,196 @@
+import re
+from unittest import mock
+
+import numpy as np
+import pytest
+from sqlalchemy import func, select, text
+
+from seer.db import DbGroupingRecord, Session
+from seer.grouping.grouping import (
+    MAX_EF_SEARCH,
+    MIN_EF_SEARCH,
+    GroupingLookup,
+    GroupingRequest,
+    ef_search,
+    nearest_neighbors_stmt,
+)
+from seer.grouping.stacktrace import canonicalize_stacktrace
+from tests.grouping.conftest import lookup_neighbors, near, random_embeddings, save_records
+
+
+def count_records(group_id: int) -> int:
+    with Session() as session:
+        return session.scalar(select(func.count()).where(DbGroupingRecord.group_id == group_id))
+
+
+def test_nearest_neighbors_inserts_new_record_once(grouping_lookup: GroupingLookup):
+    embeddings = random_embeddings(5)
+    save_records(1, embeddings)
+
+    response = lookup_neighbors(grouping_lookup, 1, 100, near(embeddings[2]))
+    assert [r.parent_group_id for r in response.responses] == [3]
+    assert count_records(100) == 1
+
+    response = lookup_neighbors(grouping_lookup, 1, 100, near(embeddings[2], seed=2))
+    assert [r.parent_group_id for r in response.responses] == [3]
+    assert count_records(100) == 1
+
+
+def test_nearest_neighbors_respects_project_and_max_distance(grouping_lookup: GroupingLookup):
+    embeddings = random_embeddings(3)
+    save_records(1, embeddings)
+    save_records(2, embeddings, first_group_id=10)
+
+    response = lookup_neighbors(grouping_lookup, 1, 100, random_embeddings(1, seed=9)[0])
+    assert response.responses == []
+
+    response = lookup_neighbors(grouping_lookup, 2, 101, near(embeddings[0]))
+    assert [r.parent_group_id for r in response.responses] == [10]
+
+
+def test_exact_duplicate_skips_embedding(grouping_lookup: GroupingLookup):
+    embeddings = random_embeddings(2)
+    lookup_neighbors(grouping_lookup, 1, 1, embeddings[0], stacktrace="File a.py\n  raise")
+    grouping_lookup.model.encode.reset_mock()
+
+    response = lookup_neighbors(
+        grouping_lookup, 1, 2, embeddings[1], stacktrace="  File a.py\n\n  raise  "
+    )
+
+    grouping_lookup.model.encode.assert_not_called()
+    assert [
+        (r.parent_group_id, r.stacktrace_distance, r.should_group) for r in response.responses
+    ] == [(1, 0.0, True)]
+    with Session() as session:
+        duplicate = session.scalar(select(DbGroupingRecord).where(DbGroupingRecord.group_id == 2))
+        original = session.scalar(select(DbGroupingRecord).where(DbGroupingRecord.group_id == 1))
+    assert duplicate.stacktrace_hash == original.stacktrace_hash
+    assert list(duplicate.stacktrace_embedding) == list(original.stacktrace_embedding)
+
+
+def test_exact_duplicates_are_per_project(grouping_lookup: GroupingLookup):
+    embeddings = random_embeddings(2)
+    lookup_neighbors(grouping_lookup, 1, 1, embeddings[0], stacktrace="File a.py")
+    grouping_lookup.model.encode.reset_mock()
+
+    lookup_neighbors(grouping_lookup, 2, 2, embeddings[1], stacktrace="File a.py")
+
+    grouping_lookup.model.encode.assert_called_once()
+
+
+@pytest.mark.parametrize("storage_mode", ["halfvec", "binary"])
+def test_quantized_storage_modes_match_full_precision(
+    grouping_lookup: GroupingLookup, storage_mode: str
+):
+    embeddings = random_embeddings(50)
+    embeddings[1:4] = [near(embeddings[0], seed=i) for i in range(3)]
+    save_records(1, embeddings)
+    query = near(embeddings[0], seed=10)
+
+    expected = lookup_neighbors(grouping_lookup, 1, 100, query)
+    grouping_lookup.storage_mode = storage_mode
+    grouping_lookup.model.encode.reset_mock()
+    # The same group again, which excludes the record the first lookup inserted from the results
+    actual = lookup_neighbors(grouping_lookup, 1, 100, query)
+
+    grouping_lookup.model.encode.assert_called_once()
+    assert {r.parent_group_id for r in actual.responses} == {1, 2, 3, 4}
+    assert [r.parent_group_id for r in actual.responses] == [
+        r.parent_group_id for r in expected.responses
+    ]
+
+
+def test_project_queries_scan_a_single_partition():
+    embeddings = random_embeddings(4)
+    for project_id in range(1, 5):
+        save_records(project_id, embeddings[project_id - 1 : project_id], first_group_id=project_id)
+
+    stmt = select(DbGroupingRecord.group_id).where(DbGroupingRecord.project_id == 1)
+    with Session() as session:
+        compiled = stmt.compile(bind=session.get_bind(), compile_kwargs={"literal_binds": True})
+        plan = "\n".join(session.scalars(text(f"EXPLAIN {compiled}")))
+        partitions = set(
+            session.scalars(text("SELECT DISTINCT tableoid::regclass::text FROM grouping_records"))
+        )
+
+    assert len(partitions) > 1
+    assert sum(bool(re.search(rf"\b{partition}\b", plan)) for partition in partitions) == 1
+
+
+def test_ef_search_widens_with_k_and_other_projects():
+    assert ef_search(1, 100, 100) == MIN_EF_SEARCH
+    assert ef_search(5, 100, 100) == 50
+    assert ef_search(5, 100, 1_000) == 500
+    assert ef_search(5, 1, 1_000_000) == MAX_EF_SEARCH
+
+
+def test_search_breadth_is_set_for_the_transaction(grouping_lookup: GroupingLookup):
+    save_records(1, random_embeddings(3))
+    issue = GroupingRequest(group_id=100, project_id=1, stacktrace="stacktrace", message="m", k=5)
+
+    with Session() as session:
+        breadth = grouping_lookup.search_breadth(session, issue)
+        session.execute(
+            nearest_neighbors_stmt(1, 100, random_embeddings(1)[0], 5, ef_search=breadth)
+        ).all()
+        assert session.scalar(text("SHOW hnsw.ef_search")) == "50"
+        session.commit()
+        assert session.scalar(text("SHOW hnsw.ef_search")) == str(MIN_EF_SEARCH)
+
+
+def test_thresholds_beyond_the_default_max_distance_return_neighbors(
+    grouping_lookup: GroupingLookup,
+):
+    embeddings = random_embeddings(2)
+    save_records(1, embeddings)
+    query = near(embeddings[0], scale=1.0)
+
+    response = lookup_neighbors(grouping_lookup, 1, 100, query, threshold=0.5)
+    assert [(r.parent_group_id, r.should_group) for r in response.responses] == [(1, True)]
+
+    response = lookup_neighbors(grouping_lookup, 1, 101, query)
+    assert [r.parent_group_id for r in response.responses] == [100]
+
+
+@pytest.mark.asyncio
+async def test_async_lookup_inserts_and_finds_neighbors(grouping_lookup: GroupingLookup):
+    embeddings = random_embeddings(5)
+    save_records(1, embeddings)
+    grouping_lookup.model.encode.return_value = near(embeddings[2])[np.newaxis, :]
+    issue = GroupingRequest(group_id=100, project_id=1, stacktrace="stacktrace", message="m", k=5)
+
+    response = await grouping_lookup.get_nearest_neighbors_async(issue)
+
+    assert [r.parent_group_id for r in response.responses] == [3]
+    assert count_records(100) == 1
+
+
+@pytest.mark.parametrize("canonical_embeddings", [False, True])
+def test_embedded_stacktrace_follows_canonical_embeddings(
+    grouping_lookup: GroupingLookup, canonical_embeddings: bool
+):
+    grouping_lookup.canonical_embeddings = canonical_embeddings
+    stacktrace = "  File a.py, line 10\n\n  raise  "
+
+    lookup_neighbors(grouping_lookup, 1, 1, random_embeddings(1)[0], stacktrace=stacktrace)
+
+    embedded = grouping_lookup.model.encode.call_args.args[0]
+    assert embedded == [canonicalize_stacktrace(stacktrace) if canonical_embeddings else stacktrace]
+
+
+@pytest.mark.asyncio
+async def test_async_lookup_searches_the_replica(grouping_lookup: GroupingLookup):
+    grouping_lookup.model.encode.return_value = random_embeddings(1)
+    issue = GroupingRequest(group_id=100, project_id=1, stacktrace="stacktrace", message="m", k=5)
+
+    with mock.patch.object(
+        GroupingLookup, "query_replica", return_value=[(7, "message 7", 0.0)]
+    ) as query_replica, mock.patch.object(
+        GroupingLookup, "query_pgvector_and_insert"
+    ) as query_pgvector:
+        response = await grouping_lookup.get_nearest_neighbors_async(issue)
+
+    query_replica.assert_called_once()
+    query_pgvector.assert_not_called()
+    assert [r.parent_group_id for r in response.responses] == [7]
+    assert count_records(100) == 1
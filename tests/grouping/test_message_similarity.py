@@ -0,0 +1,29 @@
+import difflib
+
+import pytest
+
+from seer.grouping.message_similarity import MAX_MESSAGE_LENGTH, message_similarities
+
+
+def test_sequence_matcher_matches_difflib():
+    message = "ValueError: invalid literal for int() with base 10: 'abc'"
+    others = ["ValueError: invalid literal for int() with base 10: 'xyz'", "KeyError: 'user'"]
+
+    assert message_similarities("sequence_matcher", message, others) == [
+        difflib.SequenceMatcher(None, message, other).ratio() for other in others
+    ]
+
+
+@pytest.mark.parametrize("metric", ["sequence_matcher", "token_jaccard"])
+def test_long_messages_are_capped(metric):
+    message = "a" * MAX_MESSAGE_LENGTH
+    assert message_similarities(metric, message, [message + " b" * 10_000]) == [1.0]
+
+
+def test_token_jaccard():
+    assert message_similarities(
+        "token_jaccard",
+        "Connection refused by host",
+        ["connection REFUSED by proxy", "", "Connection refused by host"],
+    ) == [3 / 5, 0.0, 1.0]
+    assert message_similarities("token_jaccard", "...", ["!!!"]) == [1.0]
@@ -0,0 +1,41 @@
+from seer.grouping.stacktrace import canonicalize_stacktrace
+
+
+def test_volatile_tokens_and_whitespace_are_removed():
+    first = canonicalize_stacktrace(
+        '  File "app/views.py", line 12, in get\n\n    obj = load(0x7f3a2c10)\n  ValueError: bad id'
+    )
+    second = canonicalize_stacktrace(
+        'File "app/views.py", line 48, in get\n  obj = load(0x7f3a99d0)\nValueError: bad id  '
+    )
+
+    assert first == second
+    assert first == 'File "app/views.py", line, in get\nobj = load(0x)\nValueError: bad id'
+
+
+def test_file_positions_are_removed():
+    assert canonicalize_stacktrace("at render (src/app.js:10:24)") == "at render (src/app.js)"
+
+
+def test_repeated_runs_are_collapsed():
+    recursion = 'File "a.py", line 3, in f\nreturn f(n - 1)\n' * 500
+    stacktrace = canonicalize_stacktrace(f"Traceback\n{recursion}RecursionError: too deep")
+
+    assert (
+        stacktrace
+        == 'Traceback\nFile "a.py", line, in f\nreturn f(n - 1)\nRecursionError: too deep'
+    )
+
+
+def test_long_stacktraces_keep_application_lines_closest_to_the_error():
+    lines = [f"/app/src/module{i}.py in handler{i}" for i in range(10)]
+    lines.insert(5, "/usr/lib/python3.11/site-packages/flask/app.py in dispatch")
+    lines.append("KeyError: missing")
+
+    stacktrace = canonicalize_stacktrace("\n".join(lines), max_tokens=30).splitlines()
+
+    assert stacktrace[-1] == "KeyError: missing"
+    assert "/app/src/module9.py in handler9" in stacktrace
+    assert "/app/src/module0.py in handler0" not in stacktrace
+    assert not any("site-packages" in line for line in stacktrace)
+    assert stacktrace == [line for line in lines if line in stacktrace]
@@ -0,0 +1,149 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from seer.grouping.grouping import GroupingLookup
+from seer.grouping.vector_index import GroupingVectorIndex, ProjectVectors, normalize
+from tests.grouping.conftest import (
+    DIMENSIONS,
+    lookup_neighbors,
+    near,
+    random_embeddings,
+    save_records,
+)
+
+
+@pytest.fixture
+def vector_index() -> GroupingVectorIndex:
+    return GroupingVectorIndex(max_project_size=100, max_bytes=1024 * 1024)
+
+
+def test_project_vectors_search_matches_exact_cosine_distance():
+    embeddings = random_embeddings(50)
+    query = near(embeddings[3], scale=0.01)
+    project = ProjectVectors(DIMENSIONS, capacity=1)
+    for i, embedding in enumerate(embeddings):
+        project.append(i + 1, i, f"message {i}", embedding)
+
+    results = project.search(query, k=5, max_distance=2.0, exclude_group_id=-1)
+
+    expected = 1.0 - normalize(embeddings) @ normalize(query)
+    assert [group_id for group_id, _, _ in results] == list(np.argsort(expected)[:5])
+    assert results[0][0] == 3
+    assert np.allclose([distance for _, _, distance in results], np.sort(expected)[:5], atol=1e-5)
+
+
+def test_project_vectors_append_is_idempotent_per_record():
+    project = ProjectVectors(DIMENSIONS)
+    embedding = random_embeddings(1)[0]
+
+    project.append(1, 10, "message", embedding)
+    project.append(1, 10, "message", embedding)
+
+    assert len(project) == 1
+    assert project.max_id == 1
+
+
+def test_search_miss_falls_back_to_pgvector(grouping_lookup: GroupingLookup, vector_index):
+    embeddings = random_embeddings(3)
+    save_records(1, embeddings)
+    grouping_lookup.vector_index = vector_index
+
+    with mock.patch.object(vector_index, "schedule_warm") as schedule_warm:
+        response = lookup_neighbors(grouping_lookup, 1, 100, near(embeddings[0]))
+
+    schedule_warm.assert_called_once_with(1)
+    assert 1 not in vector_index
+    assert [r.parent_group_id for r in response.responses] == [1]
+
+
+def test_warmed_project_matches_pgvector(grouping_lookup: GroupingLookup, vector_index):
+    embeddings = random_embeddings(20)
+    embeddings[1:4] = [near(embeddings[0], seed=i) for i in range(3)]
+    save_records(1, embeddings)
+    query = near(embeddings[0], seed=10)
+
+    expected = lookup_neighbors(grouping_lookup, 1, 100, query)
+
+    vector_index.warm(1)
+    assert 1 in vector_index
+    grouping_lookup.vector_index = vector_index
+    with mock.patch.object(GroupingLookup, "query_pgvector_and_insert") as query_pgvector:
+        actual = lookup_neighbors(grouping_lookup, 1, 101, query)
+    query_pgvector.assert_not_called()
+
+    assert [r.parent_group_id for r in actual.responses] == [
+        r.parent_group_id for r in expected.responses
+    ]
+    assert np.allclose(
+        [r.stacktrace_distance for r in actual.responses],
+        [r.stacktrace_distance for r in expected.responses],
+        atol=1e-4,
+    )
+
+
+def test_inserted_records_become_visible(grouping_lookup: GroupingLookup, vector_index):
+    embeddings = random_embeddings(2)
+    save_records(1, embeddings)
+    vector_index.warm(1)
+    grouping_lookup.vector_index = vector_index
+
+    new_embedding = random_embeddings(1, seed=5)[0]
+    assert not lookup_neighbors(grouping_lookup, 1, 50, new_embedding).responses
+
+    # Inserted through the lookup by this process
+    vector_index.refresh(1)
+    response = lookup_neighbors(grouping_lookup, 1, 51, near(new_embedding))
+    assert [r.parent_group_id for r in response.responses] == [50]
+
+    # Inserted by another process
+    other_embedding = random_embeddings(1, seed=6)[0]
+    save_records(1, other_embedding[np.newaxis, :], first_group_id=60)
+    vector_index.refresh(1)
+    response = lookup_neighbors(grouping_lookup, 1, 61, near(other_embedding))
+    assert [r.parent_group_id for r in response.responses] == [60]
+
+
+def test_stale_projects_are_refreshed_in_the_background(vector_index: GroupingVectorIndex):
+    embeddings = random_embeddings(2)
+    save_records(1, embeddings)
+    vector_index.warm(1)
+
+    with mock.patch.object(vector_index, "schedule_refresh") as schedule_refresh:
+        vector_index.search(1, embeddings[0], 1, 0.15, -1)
+    schedule_refresh.assert_not_called()
+
+    vector_index.refresh_interval = 0
+    with mock.patch.object(vector_index, "schedule_refresh") as schedule_refresh:
+        vector_index.search(1, embeddings[0], 1, 0.15, -1)
+    schedule_refresh.assert_called_once_with(1)
+
+
+def test_oversized_projects_are_not_held(vector_index: GroupingVectorIndex):
+    vector_index.max_project_size = 2
+    save_records(1, random_embeddings(3))
+
+    vector_index.warm(1)
+
+    assert 1 not in vector_index
+    with mock.patch.object(vector_index, "_executor") as executor:
+        vector_index.schedule_warm(1)
+    executor.submit.assert_not_called()
+
+
+def test_least_recently_used_projects_are_evicted(vector_index: GroupingVectorIndex):
+    embeddings = random_embeddings(10)
+    for project_id in (1, 2, 3):
+        save_records(project_id, embeddings, first_group_id=project_id * 100)
+    project_bytes = ProjectVectors(DIMENSIONS, capacity=16).nbytes
+    vector_index.max_bytes = 2 * project_bytes
+
+    vector_index.warm(1)
+    vector_index.warm(2)
+    vector_index.search(1, embeddings[0], 1, 0.15, -1)
+    vector_index.warm(3)
+
+    assert 1 in vector_index
+    assert 2 not in vector_index
+    assert 3 in vector_index
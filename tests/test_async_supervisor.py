@@ -0,0 +1,84 @@
+import threading
+import time
+
+from seer.async_supervisor import WorkerSupervisor
+
+
+def run_until_killed(kill_event, heartbeat):
+    while not kill_event.wait(0.05):
+        heartbeat.value = time.time()
+
+
+def exit_immediately(kill_event, heartbeat):
+    pass
+
+
+def hang(kill_event, heartbeat):
+    time.sleep(60)
+
+
+def wait_for(condition, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def run_in_thread(supervisor: WorkerSupervisor) -> threading.Thread:
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_supervisor_runs_workers_until_killed():
+    supervisor = WorkerSupervisor(num_processes=2, target=run_until_killed)
+    thread = run_in_thread(supervisor)
+
+    wait_for(lambda: all(w is not None and w.heartbeat.value for w in supervisor.workers))
+    processes = [w.process for w in supervisor.workers if w is not None]
+
+    supervisor.stop()
+    thread.join(20)
+
+    assert not thread.is_alive()
+    assert [p.exitcode for p in processes] == [0, 0]
+    assert supervisor.restarts == 0
+
+
+def test_supervisor_restarts_exited_workers():
+    supervisor = WorkerSupervisor(num_processes=1, target=exit_immediately)
+    thread = run_in_thread(supervisor)
+
+    wait_for(lambda: supervisor.restarts >= 2)
+    supervisor.stop()
+    thread.join(20)
+    assert not thread.is_alive()
+
+
+def test_supervisor_backs_off_restarting_failing_workers():
+    supervisor = WorkerSupervisor(
+        num_processes=1, target=exit_immediately, restart_delay=5, max_restart_delay=20
+    )
+    assert [supervisor.backoff(n) for n in range(1, 5)] == [5, 10, 20, 20]
+
+    thread = run_in_thread(supervisor)
+    wait_for(lambda: supervisor.restarts >= 1)
+    time.sleep(2)
+    assert supervisor.restarts == 1
+    assert supervisor.workers == [None]
+
+    supervisor.stop()
+    thread.join(20)
+    assert not thread.is_alive()
+
+
+def test_supervisor_restarts_unresponsive_workers():
+    supervisor = WorkerSupervisor(
+        num_processes=1, target=hang, health_timeout=0.5, shutdown_timeout=1
+    )
+    thread = run_in_thread(supervisor)
+
+    wait_for(lambda: supervisor.restarts >= 1)
+    supervisor.stop()
+    thread.join(20)
+    assert not thread.is_alive()
@@ -0,0 +1,89 @@
+import gzip
+import io
+import random
+import zlib
+
+import pytest
+import zstandard
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+from seer.compression import MIN_COMPRESSED_SIZE, encode_response, negotiate_encoding, read_body
+
+BODY = b'{"data": [' + b", ".join(b'[1700000000, [{"count": 1}]]' for _ in range(1000)) + b"]}"
+
+
+@pytest.mark.parametrize(
+    "content_encoding,compressed",
+    [
+        (None, BODY),
+        ("identity", BODY),
+        ("gzip", gzip.compress(BODY)),
+        ("GZIP", gzip.compress(BODY)),
+        ("zstd", zstandard.ZstdCompressor().compress(BODY)),
+        ("deflate", zlib.compress(BODY)),
+        # Raw deflate data, without the zlib header and checksum
+        ("deflate", zlib.compress(BODY)[2:-4]),
+    ],
+)
+def test_read_body(content_encoding, compressed):
+    assert read_body(io.BytesIO(compressed), content_encoding) == BODY
+
+
+@pytest.mark.parametrize(
+    "content_encoding,compress",
+    [
+        ("gzip", gzip.compress),
+        ("deflate", zlib.compress),
+        ("zstd", zstandard.ZstdCompressor().compress),
+    ],
+)
+def test_read_body_stops_at_max_size(content_encoding, compress):
+    # Incompressible, so that how much of the stream was consumed shows how much was decompressed
+    stream = io.BytesIO(compress(random.Random(0).randbytes(10_000_000)))
+
+    with pytest.raises(RequestEntityTooLarge):
+        read_body(stream, content_encoding, max_size=1000)
+    assert stream.tell() < len(stream.getvalue())
+
+
+def test_read_body_rejects_bad_encodings():
+    with pytest.raises(UnsupportedMediaType):
+        read_body(io.BytesIO(BODY), "compress")
+    with pytest.raises(BadRequest):
+        read_body(io.BytesIO(BODY), "gzip")
+    with pytest.raises(BadRequest):
+        read_body(io.BytesIO(BODY), "zstd")
+    with pytest.raises(BadRequest):
+        read_body(io.BytesIO(zlib.compress(BODY)[:100]), "deflate")
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,expected",
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("gzip, deflate, br", "gzip"),
+        ("gzip, zstd", "zstd"),
+        ("zstd;q=0.5, gzip", "gzip"),
+        ("zstd;q=0, gzip;q=0", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_encode_response():
+    assert encode_response(BODY, None) == (BODY, None)
+    assert encode_response(BODY[: MIN_COMPRESSED_SIZE - 1], "gzip") == (
+        BODY[: MIN_COMPRESSED_SIZE - 1],
+        None,
+    )
+
+    body, encoding = encode_response(BODY, "gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == BODY
+
+    body, encoding = encode_response(BODY, "zstd, gzip")
+    assert encoding == "zstd"
+    assert zstandard.ZstdDecompressor().decompress(body) == BODY
@@ -0,0 +1,32 @@
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+
+from seer.db import InstrumentedQueuePool, pool_options
+
+
+def test_pool_reports_checkout_metrics():
+    engine = create_engine("sqlite://", **pool_options("test"))
+    assert isinstance(engine.pool, InstrumentedQueuePool)
+
+    with mock.patch("sentry_sdk.metrics.distribution") as distribution, mock.patch(
+        "sentry_sdk.metrics.gauge"
+    ) as gauge:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    distribution.assert_called_once_with(
+        "seer.db.pool.wait", mock.ANY, unit="second", tags={"pool": "test"}
+    )
+    gauge.assert_called_once_with("seer.db.pool.checked_out", 1, tags={"pool": "test"})
+
+
+def test_pool_options_read_the_environment(monkeypatch):
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "3")
+    monkeypatch.setenv("DATABASE_MAX_OVERFLOW", "0")
+
+    engine = create_engine("sqlite://", **pool_options("test"))
+
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 0
+    assert engine.pool._pre_ping
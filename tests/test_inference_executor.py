@@ -0,0 +1,69 @@
+import concurrent.futures
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from seer.inference_executor import InferenceExecutor
+
+
+def fake_model(started: threading.Event | None = None, release: threading.Event | None = None):
+    def encode(texts, **kwargs):
+        if started is not None:
+            started.set()
+            release.wait()
+        return np.array([[float(len(text))] for text in texts])
+
+    return mock.Mock(encode=mock.Mock(side_effect=encode))
+
+
+def test_encodes_each_text():
+    executor = InferenceExecutor(num_threads=1)
+    model = fake_model()
+
+    assert executor.encode(model, "abc").tolist() == [3.0]
+    assert executor.encode(model, "a").tolist() == [1.0]
+
+
+def test_concurrent_encodes_are_batched_per_model():
+    executor = InferenceExecutor(num_threads=1)
+    started, release = threading.Event(), threading.Event()
+    blocking_model = fake_model(started, release)
+    model, other_model = fake_model(), fake_model()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as pool:
+        first = pool.submit(executor.encode, blocking_model, "first")
+        started.wait()
+        queued = [
+            pool.submit(executor.encode, m, text)
+            for m, text in [(model, "a"), (other_model, "bb"), (model, "ccc")]
+        ]
+        while executor._queue.qsize() < len(queued):
+            pass
+        release.set()
+
+        assert first.result().tolist() == [5.0]
+        assert [f.result().tolist() for f in queued] == [[1.0], [2.0], [3.0]]
+
+    assert model.encode.call_count == 1
+    assert model.encode.call_args.args[0] == ["a", "ccc"]
+    assert other_model.encode.call_count == 1
+
+
+def test_encode_errors_are_raised_to_callers():
+    executor = InferenceExecutor(num_threads=1)
+    model = mock.Mock(encode=mock.Mock(side_effect=RuntimeError("out of memory")))
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        executor.encode(model, "text")
+
+
+def test_encode_many_batches_up_to_max_batch_size():
+    executor = InferenceExecutor(num_threads=1, max_batch_size=2)
+    model = fake_model()
+
+    embeddings = executor.encode_many(model, ["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert embeddings.tolist() == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert all(len(c.args[0]) <= 2 for c in model.encode.call_args_list)
@@ -1,7 +1,27 @@
+import asyncio
+import gzip
+import json
+import time
+import zlib
+
+import pytest
+import zstandard
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
 from flask import Flask
 from pydantic import BaseModel
+from werkzeug.exceptions import ServiceUnavailable
 
-from seer.json_api import json_api, register_json_api_views, view_functions
+from seer.json_api import (
+    ASYNC_HANDLER_ARGS,
+    ConcurrencyLimit,
+    concurrency_limits,
+    json_api,
+    register_async_json_api_views,
+    register_json_api_views,
+    request_queue_time,
+    view_functions,
+)
 
 
 class DummyRequest(BaseModel):
@@ -35,7 +55,285 @@ def test_json_api_decorator():
         assert response.status_code == 200
         assert response.get_json() == {"blah": "do it"}
 
+        response = test_client.post(
+            "/v0/some/url", data="{not json", content_type="application/json"
+        )
+        assert response.status_code == 400
+
+        response = test_client.post("/v0/some/url", json=["thing", 12])
+        assert response.status_code == 400
+
         assert my_endpoint(DummyRequest(thing="thing", b=12)) == DummyResponse(blah="do it")
     finally:
         view_functions.clear()
         view_functions.extend(old_view_functions)
+
+
+def test_json_api_async_implementation():
+    old_view_functions = [*view_functions]
+    app = Flask(__name__)
+    test_client = app.test_client()
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/async/url")
+        async def my_endpoint(request: DummyRequest) -> DummyResponse:
+            await asyncio.sleep(0)
+            return DummyResponse(blah=request.thing * request.b)
+
+        register_json_api_views(app)
+
+        response = test_client.post("/v0/some/async/url", json={"thing": "a", "b": 3})
+        assert response.status_code == 200
+        assert response.get_json() == {"blah": "aaa"}
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
+
+
+@pytest.mark.asyncio
+async def test_async_json_api_views():
+    old_view_functions = [*view_functions]
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/url")
+        def my_endpoint(request: DummyRequest) -> DummyResponse:
+            return DummyResponse(blah=request.thing)
+
+        @json_api("/v0/some/async/url")
+        async def my_async_endpoint(request: DummyRequest) -> DummyResponse:
+            return DummyResponse(blah=str(request.b))
+
+        app = web.Application(handler_args=ASYNC_HANDLER_ARGS)
+        register_async_json_api_views(app)
+
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/v0/some/url", json={"thing": "thing", "b": 12})
+            assert response.status == 200
+            assert await response.json() == {"blah": "thing"}
+
+            response = await client.post("/v0/some/async/url", json={"thing": "thing", "b": 12})
+            assert response.status == 200
+            assert await response.json() == {"blah": "12"}
+
+            response = await client.post("/v0/some/url", json={"thing": "thing"})
+            assert response.status == 400
+
+            response = await client.post("/v0/some/url", json=["thing"])
+            assert response.status == 400
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
+
+
+@pytest.mark.asyncio
+async def test_json_api_compression():
+    old_view_functions = [*view_functions]
+    flask_app = Flask(__name__)
+    test_client = flask_app.test_client()
+    body = json.dumps({"thing": "thing" * 1000, "b": 12}).encode()
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/url")
+        def my_endpoint(request: DummyRequest) -> DummyResponse:
+            return DummyResponse(blah=request.thing)
+
+        register_json_api_views(flask_app)
+        response = test_client.post(
+            "/v0/some/url",
+            data=zstandard.ZstdCompressor().compress(body),
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "zstd",
+                "Accept-Encoding": "gzip",
+            },
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(response.data)) == {"blah": "thing" * 1000}
+
+        app = web.Application(handler_args=ASYNC_HANDLER_ARGS)
+        register_async_json_api_views(app)
+        async with TestClient(TestServer(app)) as client:
+            for content_encoding, compressed in (
+                ("gzip", gzip.compress(body)),
+                ("zstd", zstandard.ZstdCompressor().compress(body)),
+            ):
+                response = await client.post(
+                    "/v0/some/url",
+                    data=compressed,
+                    headers={
+                        "Content-Type": "application/json",
+                        "Content-Encoding": content_encoding,
+                        "Accept-Encoding": "zstd",
+                    },
+                    auto_decompress=False,
+                )
+                assert response.status == 200
+                assert response.headers["Content-Encoding"] == "zstd"
+                assert json.loads(
+                    zstandard.ZstdDecompressor().decompress(await response.read())
+                ) == {"blah": "thing" * 1000}
+
+            response = await client.post(
+                "/v0/some/url",
+                data=body,
+                headers={"Content-Type": "application/json", "Content-Encoding": "compress"},
+            )
+            assert response.status == 415
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
+
+
+def test_concurrency_limit_sheds_requests_over_capacity():
+    limit = ConcurrencyLimit("/v0/some/url", max_concurrency=1, queue_timeout=0.01)
+
+    with limit.acquire():
+        assert limit.in_flight == 1
+        with pytest.raises(ServiceUnavailable) as e:
+            with limit.acquire():
+                pass
+        assert dict(e.value.get_headers())["Retry-After"] == "1"
+        assert limit.queued == 0
+
+    with limit.acquire():
+        pass
+    assert limit.in_flight == 0
+
+    with pytest.raises(ServiceUnavailable):
+        with limit.acquire(waited=0.02):
+            pass
+    assert limit.in_flight == 0
+
+
+@pytest.mark.parametrize(
+    "header,queue_time",
+    [
+        (None, 0.0),
+        ("", 0.0),
+        ("garbage", 0.0),
+        ("t=1700000000.5", 1.5),
+        ("1700000000500", 1.5),
+        ("t=1700000000500000", 1.5),
+        ("1700000003", 0.0),
+    ],
+)
+def test_request_queue_time(header, queue_time):
+    assert request_queue_time(header, now=1700000002.0) == pytest.approx(queue_time)
+
+
+def test_json_api_sheds_requests_queued_upstream():
+    app = Flask(__name__)
+    old_view_functions = [*view_functions]
+    calls = []
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/limited/url", max_concurrency=1, queue_timeout=0.5)
+        def my_endpoint(request: DummyRequest) -> DummyResponse:
+            calls.append(request)
+            return DummyResponse(blah=request.thing)
+
+        register_json_api_views(app)
+        client = app.test_client()
+
+        response = client.post(
+            "/v0/some/limited/url",
+            json={"thing": "thing", "b": 12},
+            headers={"X-Request-Start": f"t={time.time() - 1}"},
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert not calls
+
+        response = client.post(
+            "/v0/some/limited/url",
+            json={"thing": "thing", "b": 12},
+            headers={"X-Request-Start": f"t={time.time()}"},
+        )
+        assert response.status_code == 200
+        assert len(calls) == 1
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
+        concurrency_limits.pop("/v0/some/limited/url", None)
+
+
+@pytest.mark.asyncio
+async def test_async_json_api_views_shed_requests_over_capacity():
+    old_view_functions = [*view_functions]
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/limited/url", max_concurrency=1, queue_timeout=0.05)
+        async def my_endpoint(request: DummyRequest) -> DummyResponse:
+            started.set()
+            await release.wait()
+            return DummyResponse(blah=request.thing)
+
+        app = web.Application(handler_args=ASYNC_HANDLER_ARGS)
+        register_async_json_api_views(app)
+
+        async with TestClient(TestServer(app)) as client:
+            first = asyncio.create_task(
+                client.post("/v0/some/limited/url", json={"thing": "thing", "b": 12})
+            )
+            await started.wait()
+
+            response = await client.post("/v0/some/limited/url", json={"thing": "thing", "b": 12})
+            assert response.status == 503
+            assert response.headers["Retry-After"] == "1"
+
+            release.set()
+            response = await first
+            assert response.status == 200
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
+        concurrency_limits.pop("/v0/some/limited/url", None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "content_encoding,compress,status",
+    [
+        ("deflate", zlib.compress, 200),
+        ("deflate", lambda body: zlib.compress(body)[2:-4], 200),
+        ("br", lambda body: body, 415),
+    ],
+)
+async def test_json_api_servers_accept_the_same_encodings(content_encoding, compress, status):
+    old_view_functions = [*view_functions]
+    flask_app = Flask(__name__)
+    test_client = flask_app.test_client()
+    body = compress(json.dumps({"thing": "thing", "b": 12}).encode())
+    headers = {"Content-Type": "application/json", "Content-Encoding": content_encoding}
+
+    try:
+        view_functions.clear()
+
+        @json_api("/v0/some/url")
+        def my_endpoint(request: DummyRequest) -> DummyResponse:
+            return DummyResponse(blah=request.thing)
+
+        register_json_api_views(flask_app)
+        assert test_client.post("/v0/some/url", data=body, headers=headers).status_code == status
+
+        app = web.Application(handler_args=ASYNC_HANDLER_ARGS)
+        register_async_json_api_views(app)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/v0/some/url", data=body, headers=headers)
+            assert response.status == status
+    finally:
+        view_functions.clear()
+        view_functions.extend(old_view_functions)
@@ -0,0 +1,67 @@
+import datetime
+import math
+from unittest import mock
+
+import pytest
+from sqlalchemy import select, text
+
+from seer.db import ProcessRequest, ReplicaSession, Session, replica_router, statement_writes
+
+
+@pytest.fixture
+def replica():
+    # The test database is not a replica, so it reports no lag.
+    replica_router.configure(Session.kw["bind"], max_lag=1.0)
+    try:
+        yield replica_router
+    finally:
+        replica_router.enabled = False
+        replica_router.last_write = -math.inf
+        replica_router._lag_checked_at = -math.inf
+        ReplicaSession.configure(bind=None)
+
+
+def test_no_replica_stays_on_primary():
+    assert replica_router.session() is None
+
+
+def test_reads_go_to_an_up_to_date_replica(replica):
+    with replica.session() as session:
+        assert session.get_bind() is Session.kw["bind"]
+    assert replica.lag() == 0
+
+
+def test_lagging_replica_stays_on_primary(replica):
+    with mock.patch.object(replica, "lag", return_value=5.0):
+        assert replica.session() is None
+
+
+def test_reads_after_own_writes_stay_on_primary(replica):
+    with Session() as session:
+        session.execute(ProcessRequest.schedule_stmt("work", {}, datetime.datetime.utcnow()))
+        session.commit()
+
+    assert replica.session(consistent_with_writes=True) is None
+    with replica.session() as session:
+        assert session is not None
+
+
+def test_read_only_commits_are_not_writes(replica):
+    with Session() as session:
+        session.scalars(select(ProcessRequest)).all()
+        session.commit()
+
+    with replica.session(consistent_with_writes=True) as session:
+        assert session is not None
+
+
+def test_statement_writes():
+    assert statement_writes(ProcessRequest.schedule_stmt("work", {}, datetime.datetime.utcnow()))
+    assert statement_writes(text("DELETE FROM process_request"))
+    assert not statement_writes(select(ProcessRequest))
+    assert not statement_writes(text("SHOW hnsw.ef_search"))
+
+
+def test_unreachable_replica_stays_on_primary(replica):
+    with mock.patch("seer.db.ReplicaSession", side_effect=ConnectionError("replica is down")):
+        assert replica.session() is None
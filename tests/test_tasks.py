@@ -3,6 +3,7 @@ import dataclasses
 import datetime
 import time
 from typing import Annotated, Callable, Self
+from unittest import mock
 
 import pytest
 from celery import Celery, Task
@@ -13,10 +14,16 @@ from johen.generators import specialized
 from johen.pytest import parametrize
 from pydantic import BaseModel
 from sqlalchemy import select, text
-from sqlalchemy.exc import OperationalError
 
-from seer.db import ProcessRequest, Session
-from seer.tasks import AsyncApp, AsyncSession, AsyncTaskFactory, acquire_x_lock
+from seer.db import (
+    BULK_LANE,
+    DEFAULT_LANE,
+    ProcessRequest,
+    ScheduleBuffer,
+    Session,
+    coalesce_schedule,
+)
+from seer.tasks import AsyncApp, AsyncSession, AsyncTaskFactory, hold_name_lock
 from tests.generators import Future, Now, Past
 
 
@@ -176,6 +183,72 @@ def test_next_schedule(
     )
 
 
+@parametrize
+def test_concurrent_acquisitions_skip_locked_work(
+    scheduled: tuple[ScheduledWork, ScheduledWork, ScheduledWork, ScheduledWork]
+):
+    for s in scheduled:
+        s.save()
+
+    with Session() as session:
+        # Holds the row locks of the first batch until the end of the block
+        held = session.scalars(ProcessRequest.acquire_work_stmt(2, datetime.datetime.now())).all()
+        assert len(held) == 2
+
+        with Session() as other_session:
+            other_session.execute(text("SET LOCAL lock_timeout = '1s'"))
+            acquired = ProcessRequest.acquire_work(4, datetime.datetime.now(), other_session)
+
+        assert len(acquired) == 2
+        assert {p.name for p in held}.isdisjoint(p.name for p in acquired)
+        session.commit()
+
+
+@parametrize
+def test_acquisition_caps_lanes(
+    scheduled: tuple[ScheduledWork, ScheduledWork, ScheduledWork, ScheduledWork]
+):
+    for s in scheduled[:3]:
+        s.process_request.lane = BULK_LANE
+    for s in scheduled:
+        s.save()
+
+    app = AsyncApp(lane_concurrency={BULK_LANE: 1})
+    with Session() as session:
+        acquired = app.acquire_work(session, 4, {BULK_LANE: 1})
+
+    assert sorted(p.lane for p in acquired) == [BULK_LANE, DEFAULT_LANE]
+
+
+@parametrize
+def test_batched_lease_renewal_and_completion(
+    scheduled: tuple[ScheduledWork, ScheduledWork, ScheduledWork]
+):
+    for s in scheduled:
+        s.save()
+
+    now = datetime.datetime.now()
+    acquired = ProcessRequest.acquire_work(3, now)
+    assert len(acquired) == 3
+
+    lease = datetime.timedelta(hours=2)
+    with Session() as session:
+        session.execute(ProcessRequest.renew_leases_stmt(acquired[:2], now, lease))
+        session.commit()
+    for s in scheduled:
+        s.reload()
+    renewed = [s for s in scheduled if s.process_request.scheduled_for == now + lease]
+    assert len(renewed) == 2
+
+    with Session() as session:
+        session.execute(ProcessRequest.mark_completed_batch_stmt(acquired[:2]))
+        session.commit()
+        remaining = session.scalars(
+            select(ProcessRequest.id).where(ProcessRequest.id.in_([p.id for p in acquired]))
+        ).all()
+    assert remaining == [acquired[2].id]
+
+
 @parametrize
 def test_next_schedule(scheduled: ScheduledWork):
     scheduled.save()
@@ -196,6 +269,85 @@ def test_next_schedule(scheduled: ScheduledWork):
     assert changed.to_value(datetime.timedelta(minutes=8))
 
 
+@parametrize(count=1)
+def test_retries_count_acquisitions_since_scheduled(scheduled: ScheduledWork):
+    scheduled.process_request.scheduled_from -= datetime.timedelta(minutes=10)
+    scheduled.process_request.acquisitions = 0
+    scheduled.save()
+
+    now = scheduled.process_request.scheduled_for
+    retries = []
+    for _ in range(3):
+        now += datetime.timedelta(hours=2)
+        (acquired,) = ProcessRequest.acquire_work(1, now)
+        retries.append(acquired.retries())
+    assert retries == [0, 1, 2]
+
+    with Session() as session:
+        session.execute(
+            ProcessRequest.schedule_stmt(
+                scheduled.process_request.name, {}, now, datetime.timedelta(minutes=10)
+            )
+        )
+        session.commit()
+    (acquired,) = ProcessRequest.acquire_work(1, now + datetime.timedelta(minutes=1))
+    assert acquired.retries() == 0
+
+
+def test_coalesce_schedule_keeps_latest_payload_and_earliest_time():
+    now = datetime.datetime.utcnow()
+    first = ProcessRequest.schedule_values("work", {"v": 1}, now)
+    second = ProcessRequest.schedule_values(
+        "work", {"v": 2}, now + datetime.timedelta(minutes=5), datetime.timedelta(minutes=3)
+    )
+
+    row = coalesce_schedule(coalesce_schedule(None, first), second)
+    assert row["payload"] == {"v": 2}
+    assert row["scheduled_for"] == now
+    assert row["scheduled_for"] - row["scheduled_from"] == datetime.timedelta(minutes=3)
+
+
+def test_schedule_buffer_coalesces_into_one_upsert():
+    now = datetime.datetime.utcnow()
+    buffer = ScheduleBuffer(window=60)
+    buffer.schedule("work", {"v": 1}, now + datetime.timedelta(minutes=5))
+    buffer.schedule("work", {"v": 2}, now)
+    buffer.schedule("work", {"v": 3}, now + datetime.timedelta(minutes=1))
+    buffer.schedule("other", {"v": 4}, now)
+    assert len(buffer.pending) == 2
+
+    with mock.patch("sentry_sdk.metrics.distribution") as distribution:
+        buffer.flush()
+    distribution.assert_called_once_with("seer.process_request.schedule_batch", 2)
+    assert not buffer.pending
+
+    with Session() as session:
+        work = session.scalars(select(ProcessRequest).where(ProcessRequest.name == "work")).one()
+    assert work.payload == {"v": 3}
+    assert work.scheduled_for == now
+
+
+@pytest.mark.asyncio
+@parametrize(count=1)
+async def test_report_queue_metrics(scheduled: tuple[ScheduledWork, ScheduledWork]):
+    scheduled[0].process_request.name = "grouping-backfill:1:0"
+    scheduled[1].process_request.name = "grouping-backfill:1:1"
+    for s in scheduled:
+        s.process_request.scheduled_for = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        s.save()
+
+    with mock.patch("sentry_sdk.metrics.gauge") as gauge:
+        await AsyncApp().report_queue_metrics()
+
+    gauge.assert_any_call("seer.process_request.ready", 2, tags={"prefix": "grouping-backfill"})
+    age = next(
+        c.args[1]
+        for c in gauge.call_args_list
+        if c.args[0] == "seer.process_request.oldest_ready_age"
+    )
+    assert age >= 60
+
+
 @parametrize
 def test_peek_scheduled(scheduled: ScheduledWork, future: Future):
     peek_watcher = change_watcher(ProcessRequest.peek_next_scheduled)
@@ -214,6 +366,22 @@ def test_peek_scheduled(scheduled: ScheduledWork, future: Future):
     assert changes.to_value(scheduled.process_request.scheduled_for)
 
 
+def test_acquire_size_follows_idle_consumers():
+    app = AsyncApp(num_consumers=3, prefetch=1, max_batch_size=3)
+    assert app.queue.maxsize == 4
+    assert app.acquire_size == 1
+
+    app.idle_consumers = 3
+    assert app.acquire_size == 3
+
+    app.queue.put_nowait(object())
+    app.queue.put_nowait(object())
+    assert app.acquire_size == 2
+
+    app.idle_consumers = 0
+    assert app.acquire_size == 0
+
+
 class TestRequest(BaseModel):
     my_special_value: str
 
@@ -298,6 +466,33 @@ async def test_next_schedule_async(test: ScheduleAsyncTest, now: Now):
     assert process is not None
 
 
+@pytest.mark.asyncio
+@parametrize(count=1)
+async def test_scheduled_work_wakes_up_idle_producer(test: ScheduleAsyncTest):
+    app = test.create_app()
+    app.consumer_sleep = 60
+    run_task = asyncio.create_task(app.run())
+    # Let the producer find the queue empty and start waiting
+    await asyncio.sleep(1)
+
+    async with AsyncSession() as session:
+        await session.execute(
+            ProcessRequest.schedule_stmt(
+                test.acceptable_name,
+                test.payload,
+                when=datetime.datetime.utcnow() - datetime.timedelta(seconds=1),
+            )
+        )
+        await session.commit()
+
+    processed = await test.new_side_effect()
+    test.end_event.set()
+    async with asyncio.timeout(10):
+        await run_task
+
+    assert processed == [test.payload.my_special_value]
+
+
 @pytest.mark.asyncio
 @parametrize(arg_set=("test_value", "error_msg"))
 async def test_async_celery_job_failure(
@@ -375,25 +570,37 @@ async def test_async_celery_job_generator_cancels(
     assert sent_buff == list(iterations[:2])
 
 
+@dataclasses.dataclass
+class BurstAsyncResult:
+    updates: list[int]
+
+    def get(self, on_message: Callable[[dict], None], propagate: bool):
+        for update in self.updates:
+            on_message({"status": "PROGRESS", "result": update})
+        on_message({"status": "SUCCESS", "result": None})
+
+
+@pytest.mark.asyncio
+async def test_async_celery_job_delivers_every_update():
+    factory = TestAsyncTaskFactory()
+    updates = list(range(1000))
+
+    async with asyncio.timeout(10):
+        received = [
+            update async for update in factory.async_celery_job(lambda: BurstAsyncResult(updates))
+        ]
+
+    assert received == updates
+
+
 @pytest.mark.asyncio
 @parametrize
-async def test_acquire_x_lock(names: tuple[str, str]):
-    async with AsyncSession() as session, acquire_x_lock(names[0], session) as a:
+async def test_hold_name_lock(names: tuple[str, str]):
+    async with hold_name_lock(names[0]) as a:
         assert a is True
-        async with AsyncSession() as session2, acquire_x_lock(names[0], session2) as b:
+        async with hold_name_lock(names[0]) as b:
             assert b is False
-            async with AsyncSession() as session3, acquire_x_lock(names[1], session3) as c:
+            async with hold_name_lock(names[1]) as c:
                 assert c is True
-    async with acquire_x_lock(names[0], session) as a:
+    async with hold_name_lock(names[0]) as a:
         assert a is True
-
-
-@pytest.mark.asyncio
-@parametrize(count=1)
-async def test_acquire_x_lock_failure(name: str):
-    with pytest.raises(OperationalError):
-        async with AsyncSession() as session:
-            async with acquire_x_lock(name, session) as a:
-                await session.execute(text("SET idle_in_transaction_session_timeout = '2s'"))
-                assert a
-                await asyncio.sleep(5)
@@ -0,0 +1,8 @@
+#!/bin/bash
+
+if [ "$ASYNC_SERVER_ENABLE" = "true" ]; then
+    echo "Starting async web server..."
+    exec gunicorn --bind :$PORT --worker-class aiohttp.GunicornWebWorker --timeout 0 src.seer.async_app:create_app
+else
+    exec gunicorn --bind :$PORT --worker-class sync --threads 1 --timeout 0 src.seer.app:app
+fi